@@ -1,11 +1,63 @@
+# Атлас зон радужки в полярной развёртке unwrap_iris: строки — радиус (кольца), столбцы — угол (секторы).
+# Зона = (angle_sector, ring), индекс ia*n_rad + ir — тот же порядок, что у iris_geom.sector_grid.
+# Таблица имён и растр меток [radii, angles] строятся один раз на (angles, radii, n_ang, n_rad);
+# статистика по зонам для любого признака того же размера — один проход np.bincount.
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+
+ORGANS = {
+    0:"ЦНС/головной мозг",1:"Шея/гортань",2:"Лёгкие(верх)",3:"Лёгкие(ср)",
+    4:"Сердце/перикард",5:"Печень/ЖП",6:"Поджелудочная",7:"ДПК",
+    8:"Тонкая кишка",9:"Тонкая кишка",10:"Толстая(восх.)",11:"Толстая(попер.)",
+    12:"Толстая(нисх.)",13:"Почки/надпоч.",14:"Мочевой тракт",15:"Половые органы",
+    16:"Поясница/крестец",17:"Суставы НК",18:"Селезёнка/лимфа",19:"ЖКТ(общ)",
+    20:"ЖКТ(общ)",21:"Бронхи",22:"Глотка/миндалины",23:"Голова/лицо",
+}
+LAYERS = {0:"околозрачк. зона",1:"вн. радужка",2:"ср. радужка",3:"нар. радужка",4:"краевой пояс"}
+
+
+@lru_cache(maxsize=32)
+def zone_names(n_ang: int=24, n_rad: int=5) -> np.ndarray:
+    # [n_ang*n_rad] строк в порядке sector_grid; имена для массива индексов — zone_names(...)[idx]
+    names = np.array([f"{ORGANS.get(ia, 'Зона?')} — {LAYERS.get(ir, f'слой {ir}')}"
+                      for ia in range(n_ang) for ir in range(n_rad)], dtype=object)
+    names.setflags(write=False)
+    return names
+
+
 def zone_name(angle_sector: int, ring: int, n_ang: int=24, n_rad: int=5) -> str:
-    organs = {
-        0:"ЦНС/головной мозг",1:"Шея/гортань",2:"Лёгкие(верх)",3:"Лёгкие(ср)",
-        4:"Сердце/перикард",5:"Печень/ЖП",6:"Поджелудочная",7:"ДПК",
-        8:"Тонкая кишка",9:"Тонкая кишка",10:"Толстая(восх.)",11:"Толстая(попер.)",
-        12:"Толстая(нисх.)",13:"Почки/надпоч.",14:"Мочевой тракт",15:"Половые органы",
-        16:"Поясница/крестец",17:"Суставы НК",18:"Селезёнка/лимфа",19:"ЖКТ(общ)",
-        20:"ЖКТ(общ)",21:"Бронхи",22:"Глотка/миндалины",23:"Голова/лицо",
-    }
-    layers = {0:"околозрачк. зона",1:"вн. радужка",2:"ср. радужка",3:"нар. радужка",4:"краевой пояс"}
-    return f"{organs.get(angle_sector % n_ang,'Зона?')} — {layers.get(ring % n_rad,f'слой {ring}')}"
+    ia, ir = angle_sector % n_ang, ring % n_rad
+    if ir != ring and ir not in LAYERS:
+        # вне таблицы слоёв подпись берёт исходный номер кольца
+        return f"{ORGANS.get(ia, 'Зона?')} — слой {ring}"
+    return zone_names(n_ang, n_rad)[ia*n_rad + ir]
+
+
+@lru_cache(maxsize=32)
+def zone_labels(angles: int=360, radii: int=96, n_ang: int=24, n_rad: int=5) -> np.ndarray:
+    # int32 [radii, angles]: индекс зоны каждого пикселя развёртки; хвосты, не кратные n_ang/n_rad
+    # (их отбрасывает и sector_grid), получают метку n_ang*n_rad — лишняя корзина bincount
+    rs, as_ = radii // n_rad, angles // n_ang
+    ring = np.arange(radii) // max(rs, 1)
+    sector = np.arange(angles) // max(as_, 1)
+    n = n_ang * n_rad
+    labels = np.where((ring[:, None] < n_rad) & (sector[None, :] < n_ang),
+                      sector[None, :] * n_rad + ring[:, None], n).astype(np.int32)
+    labels.setflags(write=False)
+    return labels
+
+
+def zone_stats(feature: np.ndarray, n_ang: int=24, n_rad: int=5) -> Dict[str, np.ndarray]:
+    # feature [radii, angles] (как полоса unwrap_iris) -> count/mean/std по зонам, каждый [n_ang*n_rad]
+    f = np.asarray(feature, dtype=np.float64)
+    labels = zone_labels(f.shape[1], f.shape[0], n_ang, n_rad).ravel()
+    n = n_ang * n_rad
+    f = f.ravel()
+    count = np.bincount(labels, minlength=n + 1)
+    c = np.maximum(count, 1)
+    mean = np.bincount(labels, weights=f, minlength=n + 1) / c
+    d = f - mean[labels]  # отклонения от среднего своей зоны: без потери точности s2 - s1²
+    var = np.bincount(labels, weights=d*d, minlength=n + 1) / c
+    return {"count": count[:n], "mean": mean[:n], "std": np.sqrt(var[:n])}
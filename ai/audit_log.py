@@ -0,0 +1,172 @@
+# Журнал аудита: append-only JSON lines в ротируемых сегментах вместо файла на каждое событие.
+# append() только кладёт событие в очередь; фоновый поток пишет накопившуюся пачку одним write()
+# (group commit) и делает fsync каждые fsync_every событий или не реже чем раз в fsync_ms.
+# Сегмент: <dir>/audit-<ms старта>-<pid>-<seq>.jsonl, новый — при превышении segment_max_bytes.
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+_STOP = object()
+log = logging.getLogger(__name__)
+
+
+class AuditLog:
+    def __init__(self, dir_path: Path, fsync_every: int = 64, fsync_ms: int = 200,
+                 segment_max_bytes: int = 64 * 1024 * 1024):
+        self.dir = Path(dir_path)
+        self.fsync_every = max(1, int(fsync_every))
+        self.fsync_s = max(0, int(fsync_ms)) / 1000.0
+        self.segment_max_bytes = segment_max_bytes
+        self._q: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._fh = None
+        self._seg_bytes = 0
+        self._seq = 0
+        self._run_id = f"{int(time.time() * 1000)}-{os.getpid()}"
+        self._flushed = threading.Condition()
+        self._queued = 0   # событий поставлено в очередь
+        self._durable = 0  # из них обработано писателем и прошло fsync (или потеряно с ошибкой)
+        self.stats = {"events": 0, "batches": 0, "fsyncs": 0, "segments": 0, "errors": 0}
+
+    # --- запись ---
+    def append(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        self._ensure_thread()
+        with self._flushed:
+            self._queued += 1
+            self._q.put(line.encode("utf-8"))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        # дождаться записи и fsync всего, что поставлено в очередь к этому моменту
+        with self._flushed:
+            target = self._queued
+            if self._thread is None or self._durable >= target:
+                return True
+            self._q.put(None)  # принудительный fsync
+            return self._flushed.wait_for(lambda: self._durable >= target, timeout)
+
+    def close(self) -> None:
+        t = self._thread
+        if t is not None:
+            self._q.put(_STOP)
+            t.join(timeout=5.0)
+            self._thread = None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+                    self._thread.start()
+
+    def _open_segment(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._seq += 1
+        self._fh = open(self.dir / f"audit-{self._run_id}-{self._seq:04d}.jsonl", "ab", buffering=0)
+        self._seg_bytes = self._fh.tell()
+        self.stats["segments"] += 1
+
+    def _sync(self) -> None:
+        if self._fh is not None:
+            os.fsync(self._fh.fileno())
+            self.stats["fsyncs"] += 1
+
+    def _run(self) -> None:
+        unsynced, last_sync, done = 0, time.monotonic(), 0
+        stop = False
+        while not stop:
+            wait = None
+            if unsynced:
+                wait = max(0.0, self.fsync_s - (time.monotonic() - last_sync))
+            try:
+                item = self._q.get(timeout=wait) if wait is None or wait > 0 else self._q.get_nowait()
+            except queue.Empty:
+                item = None
+            batch: List[bytes] = []
+            force = item is None
+            while True:
+                if item is _STOP:
+                    stop = force = True
+                elif item is not None:
+                    batch.append(item)
+                else:
+                    force = True
+                try:
+                    item = self._q.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    if self._fh is None or self._seg_bytes >= self.segment_max_bytes:
+                        if self._fh is not None:
+                            self._sync()
+                            unsynced = 0
+                        self._open_segment()
+                    data = b"".join(batch)
+                    self._fh.write(data)
+                    self._seg_bytes += len(data)
+                    unsynced += len(batch)
+                    self.stats["events"] += len(batch)
+                    self.stats["batches"] += 1
+                if unsynced and (force or unsynced >= self.fsync_every
+                                 or time.monotonic() - last_sync >= self.fsync_s):
+                    self._sync()
+                    unsynced, last_sync = 0, time.monotonic()
+            except OSError:
+                # сегмент бросаем, следующая пачка откроет новый
+                self.stats["errors"] += 1
+                log.exception("audit write failed, %d events lost", len(batch))
+                try:
+                    self._fh.close()
+                except Exception:
+                    pass
+                self._fh, unsynced = None, 0
+            done += len(batch)
+            if not unsynced:
+                with self._flushed:
+                    self._durable = done
+                    self._flushed.notify_all()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+# --- чтение ---
+def iter_events(dir_path: Path, exam_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    # сегменты по порядку записи; по exam_id сначала дешёвый поиск подстроки, потом разбор JSON
+    needle = None
+    if exam_id is not None:
+        needle = json.dumps({"exam_id": exam_id}, ensure_ascii=False, separators=(",", ":"))[1:-1].encode("utf-8")
+    for seg in sorted(Path(dir_path).glob("audit-*.jsonl")):
+        with open(seg, "rb") as f:
+            for line in f:
+                if needle is not None and needle not in line:
+                    continue
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue  # недописанная строка после сбоя
+                if exam_id is None or ev.get("exam_id") == exam_id:
+                    yield ev
+
+
+def read_exam(dir_path: Path, exam_id: str) -> List[Dict[str, Any]]:
+    return list(iter_events(dir_path, exam_id))
+
+
+if __name__ == "__main__":
+    # python -m ai.audit_log ai_audit <exam_id>
+    if len(sys.argv) < 2:
+        print("usage: python -m ai.audit_log <audit_dir> [exam_id]", file=sys.stderr)
+        sys.exit(2)
+    for ev in iter_events(Path(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else None):
+        print(json.dumps(ev, ensure_ascii=False))
@@ -0,0 +1,37 @@
+# Теплокарта для отчёта: уменьшение блочным усреднением до max_side по длинной стороне
+# и кодирование в PNG (уровень сжатия) или WebP (качество). Отчёт показывает карту высотой
+# ~220 pt, так что полное разрешение кадра не нужно ни в PDF, ни на диске.
+# Карта из fused_quality уже нормирована в [0..1] — повторная нормировка только по запросу.
+import cv2
+import numpy as np
+
+FORMATS = ("png", "webp")
+
+
+def block_mean(a: np.ndarray, max_side: int) -> np.ndarray:
+    # целый коэффициент k = ceil(L / max_side); INTER_AREA при целом k — ровно среднее по блокам k×k
+    # (хвост, не кратный k, отбрасывается — меньше k пикселей по краю)
+    h, w = a.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return a
+    k = -(-max(h, w) // max_side)
+    hh, ww = max(1, h // k), max(1, w // k)
+    return cv2.resize(a[: hh * k, : ww * k], (ww, hh), interpolation=cv2.INTER_AREA)
+
+
+def encode_heatmap(score: np.ndarray, max_side: int = 0, fmt: str = "png",
+                   png_level: int = 3, webp_quality: int = 80, normalize: bool = False) -> bytes:
+    a = np.asarray(score, dtype=np.float32)
+    if normalize:
+        mn, mx, _, _ = cv2.minMaxLoc(a)
+        a = (a - np.float32(mn)) / np.float32(mx - mn) if mx > mn else np.zeros_like(a)
+    a = block_mean(a, max_side)
+    u8 = cv2.convertScaleAbs(a, alpha=255.0)  # округление и насыщение в [0..255]
+    if fmt == "webp":
+        ok, buf = cv2.imencode(".webp", u8, [cv2.IMWRITE_WEBP_QUALITY, int(webp_quality)])
+    else:
+        ok, buf = cv2.imencode(".png", u8, [cv2.IMWRITE_PNG_COMPRESSION, int(png_level)])
+    if not ok:
+        raise ValueError(f"heatmap encode failed ({fmt})")
+    return buf.tobytes()
+
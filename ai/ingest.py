@@ -0,0 +1,49 @@
+# Декодирование загрузок сразу в рабочее разрешение анализа.
+# Кадр уменьшается в целое k = ceil(длинная сторона / max_side) раз: для JPEG степень двойки из k
+# делает сам декодер (draft: 1/2, 1/4, 1/8), остаток — reduce() (box-фильтр), без дорогого resize.
+# Исходные байты не трогаем — они нужны только для архива.
+import os
+from io import BytesIO
+
+from PIL import Image
+
+
+def max_side_from_env(name: str, default: int = 0) -> int:
+    # 0 — без ограничения (полное разрешение сенсора)
+    try:
+        return max(0, int(os.environ.get(name, str(default))))
+    except Exception:
+        return default
+
+
+def int_env(name: str, default: int, lo: int, hi: int) -> int:
+    # целое из окружения в [lo, hi]; не число — ошибка при старте, а не молчаливый default
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        v = int(raw)
+    except ValueError:
+        raise ValueError(f"{name}={raw!r}: expected an integer in [{lo}, {hi}]") from None
+    return min(max(v, lo), hi)
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def decode_image(data, max_side: int = 0, mode: str = "RGB") -> Image.Image:
+    img = Image.open(BytesIO(data))
+    if not max_side or max(img.size) <= max_side:
+        return img.convert(mode)
+
+    k = _ceil_div(max(img.size), max_side)
+    if img.format == "JPEG":
+        p = 1
+        while p < 8 and k % (2 * p) == 0:
+            p *= 2
+        if p > 1:
+            img.draft(None, (_ceil_div(img.width, p), _ceil_div(img.height, p)))
+    img = img.convert(mode)
+    r = _ceil_div(max(img.size), max_side)
+    return img.reduce(r) if r > 1 else img
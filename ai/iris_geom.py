@@ -1,45 +1,125 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Tuple, Dict, Any, List
 import numpy as np, cv2
 
+from ai.atlas_map import zone_names
+
 @dataclass
 class Circles:
     center: Tuple[int,int]
     r_pupil: int
     r_iris: int
 
-def _hough_best_circle(gray: np.ndarray, min_r: int, max_r: int):
+def _edge_map(gray: np.ndarray) -> np.ndarray:
     g = cv2.GaussianBlur(gray, (9,9), 2)
-    edges = cv2.Canny(g, 30, 90)
+    return cv2.Canny(g, 30, 90)
+
+def _hough_nearest(edges: np.ndarray, min_r: int, max_r: int, hint: Tuple[int,int], near: float = 0):
+    # HoughCircles отдаёт кандидатов по убыванию голосов: берётся самый сильный в радиусе near
+    # от подсказки (текстура радужки даёт слабые смещённые окружности рядом с ней), иначе — ближайший
     circles = cv2.HoughCircles(edges, cv2.HOUGH_GRADIENT, dp=1.2, minDist=30,
                                param1=120, param2=20, minRadius=min_r, maxRadius=max_r)
     if circles is None:
-        h,w = gray.shape[:2]; cx,cy = w//2,h//2; r = int(0.25*min(h,w))
-        return (cx,cy), r
+        return None
     c = np.round(circles[0]).astype(int)
-    h,w = gray.shape[:2]; cx,cy = w//2,h//2
-    idx = np.argmin((c[:,0]-cx)**2 + (c[:,1]-cy)**2)
+    d2 = (c[:,0]-hint[0])**2 + (c[:,1]-hint[1])**2
+    close = np.flatnonzero(d2 <= near*near)
+    idx = close[0] if close.size else np.argmin(d2)
     x,y,r = c[idx]
     return (int(x),int(y)), int(r)
 
-def detect_circles(bgr: np.ndarray) -> Circles:
-    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+def _hough_best_circle(gray: np.ndarray, min_r: int, max_r: int, edges: np.ndarray = None):
+    # edges можно передать готовыми, чтобы blur+Canny считались один раз на оба прохода
+    if edges is None:
+        edges = _edge_map(gray)
+    h,w = gray.shape[:2]; cx,cy = w//2,h//2
+    found = _hough_nearest(edges, min_r, max_r, (cx,cy), near=0.25*min(h,w))
+    if found is None:
+        r = int(0.25*min(h,w))
+        return (cx,cy), r
+    return found
+
+# Пирамида: грубый поиск на уменьшенном кадре (~PYR_TARGET px по короткой стороне, шаг 4..8×),
+# затем уточнение в узкой полосе радиусов на ROI полного разрешения
+PYR_TARGET = 480
+PYR_MIN_FACTOR = 4
+PYR_MAX_FACTOR = 8
+
+def _pyramid_factor(h: int, w: int) -> int:
+    f = int(round(min(h,w) / PYR_TARGET))
+    return min(PYR_MAX_FACTOR, f) if f >= PYR_MIN_FACTOR else 1
+
+def _refine_circle(edges: np.ndarray, x0: int, y0: int, coarse, f: int, min_r: int, max_r: int):
+    # coarse в координатах уменьшенного кадра; edges — карта ROI с началом в (x0, y0)
+    (cx,cy), r = coarse
+    band = 2*f
+    lo, hi = max(min_r, r*f - band), min(max_r, r*f + band)
+    if hi <= lo:
+        lo, hi = min_r, max_r
+    hint = (cx*f - x0, cy*f - y0)
+    found = _hough_nearest(edges, lo, hi, hint, near=2*f)
+    if found is None and (lo, hi) != (min_r, max_r):
+        # в полосе вокруг грубого радиуса окружности нет — грубый радиус ошибочен:
+        # радиус ищется заново во всём диапазоне на полном разрешении, центр — тот же
+        found = _hough_nearest(edges, min_r, max_r, hint, near=2*f)
+    if found is None:
+        return (cx*f, cy*f), r*f
+    (x,y), rr = found
+    return (x + x0, y + y0), rr
+
+def detect_circles(bgr: np.ndarray, pyramid: bool = False) -> Circles:
+    # принимает и уже серый кадр [h, w]
+    gray = bgr if bgr.ndim == 2 else cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
     h,w = gray.shape[:2]
-    (cx1,cy1), r_p = _hough_best_circle(gray, int(0.06*min(h,w)), int(0.18*min(h,w)))
-    (cx2,cy2), r_i = _hough_best_circle(gray, int(0.28*min(h,w)), int(0.46*min(h,w)))
+    p_lo, p_hi = int(0.06*min(h,w)), int(0.18*min(h,w))
+    i_lo, i_hi = int(0.28*min(h,w)), int(0.46*min(h,w))
+    f = _pyramid_factor(h, w) if pyramid else 1
+    if f == 1:
+        edges = _edge_map(gray)
+        (cx1,cy1), r_p = _hough_best_circle(gray, p_lo, p_hi, edges)
+        (cx2,cy2), r_i = _hough_best_circle(gray, i_lo, i_hi, edges)
+    else:
+        small = cv2.resize(gray, (w//f, h//f), interpolation=cv2.INTER_AREA)
+        sh, sw = small.shape[:2]
+        s_edges = _edge_map(small)
+        pupil = _hough_best_circle(small, int(0.06*min(sh,sw)), int(0.18*min(sh,sw)), s_edges)
+        iris  = _hough_best_circle(small, int(0.28*min(sh,sw)), int(0.46*min(sh,sw)), s_edges)
+        # один ROI вокруг грубой радужки (зрачок внутри неё), blur+Canny на нём один раз
+        (icx,icy), ir = iris
+        m = (ir + 3)*f
+        x0, y0 = max(0, icx*f - m), max(0, icy*f - m)
+        x1, y1 = min(w, icx*f + m), min(h, icy*f + m)
+        roi_edges = _edge_map(gray[y0:y1, x0:x1])
+        (cx1,cy1), r_p = _refine_circle(roi_edges, x0, y0, pupil, f, p_lo, p_hi)
+        (cx2,cy2), r_i = _refine_circle(roi_edges, x0, y0, iris, f, i_lo, i_hi)
     cx,cy = int((cx1+cx2)/2), int((cy1+cy2)/2)
     r_p = max(8, min(r_p, int(0.9*r_i)))
     return Circles(center=(cx,cy), r_pupil=r_p, r_iris=r_i)
 
-def unwrap_iris(bgr: np.ndarray, circles: Circles, angles: int=360, radii: int=96) -> np.ndarray:
-    (cx,cy), r_in, r_out = circles.center, circles.r_pupil, circles.r_iris
+@lru_cache(maxsize=32)
+def _unit_polar_grid(angles: int, radii: int):
+    # Единичная полярная сетка (cos/sin по углу), только чтение; форма карт [radii, angles]
     theta = np.linspace(0, 2*np.pi, angles, endpoint=False)
-    rr    = np.linspace(r_in, r_out, radii)
     cos_t, sin_t = np.cos(theta), np.sin(theta)
-    x = np.outer(rr, cos_t) + cx
-    y = np.outer(rr, sin_t) + cy
-    return cv2.remap(bgr, x.astype(np.float32), y.astype(np.float32),
-                     interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT101)
+    cos_t.setflags(write=False); sin_t.setflags(write=False)
+    return cos_t, sin_t, (radii, angles)
+
+def polar_grid_cache_info() -> Dict[str, int]:
+    ci = _unit_polar_grid.cache_info()
+    return {"hits": ci.hits, "misses": ci.misses, "size": ci.currsize, "maxsize": ci.maxsize}
+
+def unwrap_iris(bgr: np.ndarray, circles: Circles, angles: int=360, radii: int=96) -> np.ndarray:
+    (cx,cy), r_in, r_out = circles.center, circles.r_pupil, circles.r_iris
+    cos_t, sin_t, shape = _unit_polar_grid(angles, radii)
+    rr = np.linspace(r_in, r_out, radii)
+    # масштаб и сдвиг кэшированной сетки в один буфер, без промежуточных outer-массивов
+    buf = np.empty(shape, dtype=np.float64)
+    np.multiply.outer(rr, cos_t, out=buf); buf += cx
+    x = buf.astype(np.float32)
+    np.multiply.outer(rr, sin_t, out=buf); buf += cy
+    y = buf.astype(np.float32)
+    return cv2.remap(bgr, x, y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT101)
 
 def sharpness_lapvar(gray: np.ndarray) -> float:
     lap = cv2.Laplacian(gray, cv2.CV_32F)
@@ -61,15 +141,70 @@ def sector_grid(angles: int=360, radii: int=96, n_ang: int=24, n_rad: int=5):
                            slice(ia*ang_step, (ia+1)*ang_step)))
     return blocks
 
-def _block_features(strip_bgr, block):
-    sub = strip_bgr[block[0], block[1]]
-    g   = cv2.cvtColor(sub, cv2.COLOR_BGR2GRAY)
-    mean = float(g.mean())/255.0
-    std  = float(g.std())/255.0
-    lapv = sharpness_lapvar(g)
-    edges = cv2.Canny(g, 40, 120)
-    edge_density = float(edges.mean()/255.0)
-    return {"mean": mean, "std": std, "lapvar": lapv, "edge_density": edge_density}
+def _sector_blocks(a: np.ndarray, n_ang: int, n_rad: int) -> np.ndarray:
+    # [H, W] -> [n_ang*n_rad, rs, as] в порядке sector_grid (ia, ir); хвосты отбрасываются как там же
+    rs, as_ = a.shape[0]//n_rad, a.shape[1]//n_ang
+    a = a[:rs*n_rad, :as_*n_ang]
+    a = a.reshape(n_rad, rs, n_ang, as_).transpose(2, 0, 1, 3)
+    return np.ascontiguousarray(a).reshape(n_ang*n_rad, rs, as_)
+
+def _laplacian_blocks(g: np.ndarray) -> np.ndarray:
+    # cv2.Laplacian(ksize=1, CV_32F) для каждого блока со своей границей REFLECT_101
+    p = np.pad(g.astype(np.float32), ((0,0),(1,1),(1,1)), mode="reflect")
+    c = p[:, 1:-1, 1:-1]
+    return p[:, :-2, 1:-1] + p[:, 2:, 1:-1] + p[:, 1:-1, :-2] + p[:, 1:-1, 2:] - 4*c
+
+_CANNY_TG22 = int(0.4142135623730950488016887242097*(1 << 15) + 0.5)
+
+def _canny_blocks(g: np.ndarray, low: int, high: int) -> np.ndarray:
+    # cv2.Canny(aperture=3, L1) для каждого блока независимо, все блоки за один проход
+    n, h, w = g.shape
+    p = np.pad(g.astype(np.int32), ((0,0),(1,1),(1,1)), mode="edge")
+    dx = (p[:, :-2, 2:] + 2*p[:, 1:-1, 2:] + p[:, 2:, 2:]) - (p[:, :-2, :-2] + 2*p[:, 1:-1, :-2] + p[:, 2:, :-2])
+    dy = (p[:, 2:, :-2] + 2*p[:, 2:, 1:-1] + p[:, 2:, 2:]) - (p[:, :-2, :-2] + 2*p[:, :-2, 1:-1] + p[:, :-2, 2:])
+    ax, ay = np.abs(dx), np.abs(dy)
+    mag = ax + ay
+    # подавление немаксимумов: за границей блока модуль градиента = 0
+    M = np.pad(mag, ((0,0),(1,1),(1,1)), mode="constant")
+    y = ay << 15
+    tg22x = ax*_CANNY_TG22
+    tg67x = tg22x + (ax << 16)
+    horiz = y < tg22x
+    vert = ~horiz & (y > tg67x)
+    diag = ~horiz & ~vert
+    neg = (dx ^ dy) < 0
+    keep = horiz & (mag > M[:, 1:-1, :-2]) & (mag >= M[:, 1:-1, 2:])
+    keep |= vert & (mag > M[:, :-2, 1:-1]) & (mag >= M[:, 2:, 1:-1])
+    keep |= diag & neg & (mag > M[:, :-2, 2:]) & (mag > M[:, 2:, :-2])
+    keep |= diag & ~neg & (mag > M[:, :-2, :-2]) & (mag > M[:, 2:, 2:])
+    cand = keep & (mag > low)
+    strong = cand & (mag > high)
+    # гистерезис: 8-связные компоненты кандидатов, блоки разделены нулевой строкой
+    mosaic = np.zeros((n, h+1, w), dtype=np.uint8)
+    mosaic[:, :h] = cand
+    _, labels = cv2.connectedComponents(mosaic.reshape(n*(h+1), w), connectivity=8)
+    labels = labels.reshape(n, h+1, w)[:, :h]
+    hit = np.zeros(int(labels.max()) + 1, dtype=bool)
+    hit[labels[strong]] = True
+    hit[0] = False
+    return hit[labels]
+
+def sector_features(strip_bgr: np.ndarray, n_ang: int=24, n_rad: int=5) -> Dict[str, np.ndarray]:
+    # Признаки всех секторов разом: mean/std/lapvar/edge_density, каждый [n_ang*n_rad] в порядке sector_grid.
+    # Значения совпадают с посекторным cvtColor+Laplacian+Canny (границы блоков учитываются как раньше).
+    gray = cv2.cvtColor(strip_bgr, cv2.COLOR_BGR2GRAY)
+    g = _sector_blocks(gray, n_ang, n_rad)
+    n = g.shape[0]
+    flat = g.reshape(n, -1)
+    lap = _laplacian_blocks(g).reshape(n, -1)
+    edges = _canny_blocks(g, 40, 120).reshape(n, -1)
+    px = flat.shape[1]
+    return {
+        "mean": flat.mean(axis=1)/255.0,
+        "std": flat.std(axis=1)/255.0,
+        "lapvar": lap.var(axis=1).astype(np.float64),
+        "edge_density": (edges.sum(axis=1)*255.0/px)/255.0,
+    }
 
 def _normalize_scores(vals: np.ndarray) -> np.ndarray:
     # Мин-макс по снимку, защита от нулевого диапазона
@@ -78,8 +213,8 @@ def _normalize_scores(vals: np.ndarray) -> np.ndarray:
         return np.zeros_like(vals, dtype=np.float32)
     return ((vals - vmin) / (vmax - vmin)).astype(np.float32)
 
-def summarize_eye(bgr: np.ndarray, n_ang: int=24, n_rad: int=5):
-    circ  = detect_circles(bgr)
+def summarize_eye(bgr: np.ndarray, n_ang: int=24, n_rad: int=5, pyramid: bool=False):
+    circ  = detect_circles(bgr, pyramid=pyramid)
     strip = unwrap_iris(bgr, circ, angles=360, radii=96)
     g = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
     quality = {
@@ -89,17 +224,17 @@ def summarize_eye(bgr: np.ndarray, n_ang: int=24, n_rad: int=5):
         "r_pupil": circ.r_pupil,
         "r_iris": circ.r_iris
     }
-    blocks = sector_grid(360, 96, n_ang, n_rad)
+    sf = sector_features(strip, n_ang, n_rad)
 
-    feats = []
+    # подписи зон — из кэшированной таблицы атласа, в том же порядке sector_grid
+    feats = [{"angle_sector": i // n_rad, "ring": i % n_rad, "zone": name,
+              "mean": float(m), "std": float(sd), "lapvar": float(lv), "edge_density": float(ed)}
+             for i, (name, m, sd, lv, ed) in enumerate(zip(zone_names(n_ang, n_rad), sf["mean"].tolist(),
+                                                            sf["std"].tolist(), sf["lapvar"].tolist(),
+                                                            sf["edge_density"].tolist()))]
     # собираем признаки для нормировки
-    tmp = []
-    for ia in range(n_ang):
-        for ir in range(n_rad):
-            f = _block_features(strip, blocks[ia*n_rad+ir])
-            feats.append({"angle_sector": ia, "ring": ir, **f})
-            tmp.append([f["std"], f["edge_density"], 1.0 - abs(0.5 - f["mean"]), f["lapvar"]])
-    tmp = np.array(tmp, dtype=np.float32)  # [N,4]
+    tmp = np.stack([sf["std"], sf["edge_density"], 1.0 - np.abs(0.5 - sf["mean"]), sf["lapvar"]],
+                   axis=1).astype(np.float32)  # [N,4]
 
     # весовая модель v1: std(0.4) + edge(0.4) + centered_mean(0.2) + lapvar(подмешиваем после нормировки)
     s_std   = _normalize_scores(tmp[:,0])
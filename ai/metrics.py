@@ -0,0 +1,186 @@
+# Метрики в текстовом формате Prometheus без внешних зависимостей: счётчики, гауги
+# и гистограммы с фиксированными корзинами (observe — bisect + два сложения под замком).
+# Стадии, выполняемые в пуле процессов, меряются там через timed() и возвращаются словарём
+# секунд; в реестр их пишет основной процесс (observe_stages).
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labels)
+        self._fn = fn  # значение снимается в момент отдачи /metrics
+
+    def inc(self, n: float = 1.0, **labels: str) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + n
+
+    def render(self) -> List[str]:
+        if self._fn is not None:
+            return self._header() + [f"{self.name} {_fmt(self._fn())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, n: float = 1.0, **labels: str) -> None:
+        self.inc(-n, **labels)
+
+    def set(self, v: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(v)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, v: float, **labels: str) -> None:
+        k = self._key(labels)
+        i = bisect_left(self.buckets, v)
+        with self._lock:
+            st = self._values.get(k)
+            if st is None:
+                st = self._values[k] = [[0] * (len(self.buckets) + 1), 0.0]
+            st[0][i] += 1
+            st[1] += v
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        out = self._header()
+        for k, (counts, total) in items:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le_label = 'le="%s"' % _fmt(le)
+                out.append(f"{self.name}_bucket{_labels(self.label_names, k, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _add(self, m):
+        self._metrics.append(m)
+        return m
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = (),
+                fn: Optional[Callable[[], float]] = None) -> Counter:
+        return self._add(Counter(name, help_text, labels, fn))
+
+    def gauge(self, name: str, help_text: str, labels: Iterable[str] = (),
+              fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._add(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str):
+    # накапливает: одна стадия может выполняться несколько раз за запрос
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - t0)
+
+
+def observe_stages(hist: Histogram, timings: Optional[Dict[str, float]], **labels: str) -> None:
+    for stage, sec in (timings or {}).items():
+        hist.observe(sec, stage=stage, **labels)
+
+
+class RequestMetricsMiddleware:
+    # pure ASGI: число запросов по статусу, в обработке и полная длительность по пути;
+    # пути вне paths сводятся в "other", чтобы не плодить ряды
+    def __init__(self, app, requests: Counter, in_flight: Gauge, latency: Histogram, paths: Iterable[str]):
+        self.app = app
+        self.requests = requests
+        self.in_flight = in_flight
+        self.latency = latency
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope.get("path", "")
+        if path not in self.paths:
+            path = "other"
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        self.in_flight.inc(path=path)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec(path=path)
+            self.latency.observe(time.perf_counter() - t0, path=path)
+            self.requests.inc(path=path, status=str(status["code"]))
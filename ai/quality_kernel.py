@@ -0,0 +1,69 @@
+# Единое ядро качества снимка: яркость, доля бликов, градиентная резкость и нормированная
+# карта градиента из одного буфера оттенков серого (uint8), без float32-копий кадра.
+# Промежуточные буферы переиспользуются между вызовами в пределах потока.
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import cv2
+
+GLARE_LEVEL = 245
+
+_tls = threading.local()
+
+
+def _scratch(h: int, w: int) -> Dict[str, np.ndarray]:
+    s = getattr(_tls, "scratch", None)
+    if s is None or s["dx"].shape != (h, w):
+        s = {
+            "dx": np.empty((h, w), np.uint8),
+            "dy": np.empty((h, w), np.uint8),
+            "sum": np.empty((h, w), np.uint16),
+        }
+        _tls.scratch = s
+    return s
+
+
+def fused_quality(gray: np.ndarray, with_map: bool = True) -> Tuple[Dict[str, float], Optional[np.ndarray]]:
+    # -> ({"brightness", "glare", "sharp_lapvar"}, карта |dx|+|dy| в [0..1] float32 или None)
+    g = np.ascontiguousarray(gray, dtype=np.uint8)
+    if g.size == 0:
+        q = {"brightness": 0.0, "glare": 0.0, "sharp_lapvar": 0.0}
+        return q, (np.zeros(g.shape, np.float32) if with_map else None)
+
+    h, w = g.shape[:2]
+    s = _scratch(h, w)
+    dx, dy = s["dx"], s["dy"]
+
+    bright = float(cv2.sumElems(g)[0] / g.size / 255.0)
+    cv2.threshold(g, GLARE_LEVEL, 255, cv2.THRESH_BINARY, dst=dx)
+    glare = float(cv2.countNonZero(dx) / g.size)
+
+    # |diff| по осям; первый столбец/строка = 0, как у карты со сдвигом на 1 пиксель
+    dx[:, 0] = 0
+    dy[0, :] = 0
+    gx = gy = 0.0
+    if w >= 2:
+        cv2.absdiff(g[:, 1:], g[:, :-1], dst=dx[:, 1:])
+        gx = cv2.sumElems(dx)[0] / (h * (w - 1))
+    if h >= 2:
+        cv2.absdiff(g[1:, :], g[:-1, :], dst=dy[1:, :])
+        gy = cv2.sumElems(dy)[0] / ((h - 1) * w)
+
+    sharp = float(gx + gy)
+    if not np.isfinite(sharp):
+        sharp = 0.0
+    q = {"brightness": bright, "glare": glare, "sharp_lapvar": sharp}
+    if not with_map:
+        return q, None
+
+    acc = s["sum"]
+    np.add(dx, dy, out=acc, dtype=np.uint16)
+    mn, mx, _, _ = cv2.minMaxLoc(acc)
+    out = acc.astype(np.float32)
+    if mx > mn:
+        out -= np.float32(mn)
+        out /= np.float32(mx - mn)
+    else:
+        out[...] = 0.0
+    return q, out
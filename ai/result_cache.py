@@ -0,0 +1,176 @@
+# Двухуровневый кэш результатов анализа по содержимому: LRU в памяти + каталог на диске.
+# Ключ — sha256 от (версия алгоритма и параметры) + сырые байты загрузки.
+# Значение — JSON-совместимый dict; к записи на диске можно приложить файлы (теплокарту):
+# байты пишутся, пути связываются жёсткой ссылкой (или копируются) — всегда через temp + rename:
+# каталоги обследований ссылаются на те же inode, перезапись на месте испортила бы их файлы.
+# file_path() — путь для чтения. Без дискового уровня приложения хранятся байтами в памяти
+# (учитываются в её квоте), их отдаёт file_bytes().
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+
+def content_key(data: bytes, *parts: Any) -> str:
+    h = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8"))
+    h.update(b"\0")
+    h.update(data)
+    return h.hexdigest()
+
+
+def _tmp_name(dst: Path) -> Path:
+    return dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _write_atomic(dst: Path, data: bytes) -> None:
+    tmp = _tmp_name(dst)
+    tmp.write_bytes(data)
+    tmp.replace(dst)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _tmp_name(dst)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    tmp.replace(dst)
+
+
+class ResultCache:
+    def __init__(self, disk_dir: Optional[Path], mem_max_bytes: int, disk_max_bytes: int):
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.mem_max_bytes = mem_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, size, files)
+        self._mem_bytes = 0
+        self._disk: Optional["OrderedDict[str, int]"] = None  # key -> bytes, по давности доступа
+        self._disk_bytes = 0
+        self._stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0,
+                       "mem_evictions": 0, "disk_evictions": 0}
+
+    # --- диск ---
+    def _entry_dir(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / key
+
+    def _disk_index(self) -> "OrderedDict[str, int]":
+        # строится один раз по существующим записям (старые — первыми на вытеснение)
+        if self._disk is None:
+            found = []
+            if self.disk_dir is not None and self.disk_dir.exists():
+                for meta in self.disk_dir.glob("*/*/value.json"):
+                    d = meta.parent
+                    try:
+                        size = sum(f.stat().st_size for f in d.iterdir())
+                        found.append((meta.stat().st_mtime, d.name, size))
+                    except OSError:
+                        continue
+            found.sort()
+            self._disk = OrderedDict((k, size) for _, k, size in found)
+            self._disk_bytes = sum(self._disk.values())
+        return self._disk
+
+    def _disk_evict(self) -> None:
+        idx = self._disk_index()
+        while self._disk_bytes > self.disk_max_bytes and idx:
+            k, size = idx.popitem(last=False)
+            self._disk_bytes -= size
+            self._stats["disk_evictions"] += 1
+            shutil.rmtree(self._entry_dir(k), ignore_errors=True)
+
+    # --- память ---
+    def _mem_put(self, key: str, value: Dict[str, Any], size: int,
+                 files: Optional[Dict[str, bytes]] = None) -> None:
+        files = files or {}
+        size += sum(len(b) for b in files.values())
+        if size > self.mem_max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= old[1]
+        self._mem[key] = (value, size, files)
+        self._mem_bytes += size
+        while self._mem_bytes > self.mem_max_bytes and self._mem:
+            _, (_, s, _) = self._mem.popitem(last=False)
+            self._mem_bytes -= s
+            self._stats["mem_evictions"] += 1
+
+    # --- API ---
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                if self.disk_dir is not None and key in self._disk_index():
+                    self._disk.move_to_end(key)
+                self._stats["mem_hits"] += 1
+                return hit[0]
+            if self.disk_dir is not None and key in self._disk_index():
+                try:
+                    raw = (self._entry_dir(key) / "value.json").read_text(encoding="utf-8")
+                    value = json.loads(raw)
+                except (OSError, ValueError):
+                    self._disk_bytes -= self._disk.pop(key, 0)
+                else:
+                    self._disk.move_to_end(key)
+                    self._mem_put(key, value, len(raw))
+                    self._stats["disk_hits"] += 1
+                    return value
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any], files: Optional[Dict[str, Union[Path, bytes]]] = None) -> None:
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._stats["puts"] += 1
+            if self.disk_dir is None:
+                mem_files = {name: bytes(src) if isinstance(src, (bytes, bytearray)) else Path(src).read_bytes()
+                             for name, src in (files or {}).items()}
+                self._mem_put(key, value, len(raw), mem_files)
+                return
+            self._mem_put(key, value, len(raw))
+            d = self._entry_dir(key)
+            try:
+                d.mkdir(parents=True, exist_ok=True)
+                for name, src in (files or {}).items():
+                    if isinstance(src, (bytes, bytearray)):
+                        _write_atomic(d / name, src)
+                    else:
+                        _link_or_copy(Path(src), d / name)
+                _write_atomic(d / "value.json", raw.encode("utf-8"))
+                size = sum(f.stat().st_size for f in d.iterdir())
+            except OSError:
+                shutil.rmtree(d, ignore_errors=True)
+                return
+            idx = self._disk_index()
+            self._disk_bytes += size - idx.pop(key, 0)
+            idx[key] = size
+            self._disk_evict()
+
+    def file_path(self, key: str, name: str) -> Optional[Path]:
+        # приложенный к записи файл; None, если записи/файла на диске уже нет
+        if self.disk_dir is None:
+            return None
+        p = self._entry_dir(key) / name
+        return p if p.is_file() else None
+
+    def file_bytes(self, key: str, name: str) -> Optional[bytes]:
+        # приложение записи из памяти (только без дискового уровня)
+        with self._lock:
+            hit = self._mem.get(key)
+            return hit[2].get(name) if hit is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s.update(mem_entries=len(self._mem), mem_bytes=self._mem_bytes, mem_max_bytes=self.mem_max_bytes,
+                     disk_entries=len(self._disk) if self._disk is not None else None,
+                     disk_bytes=self._disk_bytes if self._disk is not None else None,
+                     disk_max_bytes=self.disk_max_bytes)
+            return s
@@ -0,0 +1,261 @@
+# Хранение и очистка артефактов: TTL и квота по объёму для каталогов временных файлов,
+# отчётов и обследований. Проход потоковый (os.scandir, без полного списка путей в памяти)
+# и с ограничением темпа: после каждых batch записей — пауза, удаления тоже в счёт.
+# Записи старше TTL удаляются сразу; затем, если объём выживших больше квоты, — самые старые.
+# compact_after_s — у обследований старше этого срока удаляются файлы по compact_patterns
+# (теплокарты, PDF), снимки и JSON/TXT остаются. Удалённое не восстанавливается: после сжатия
+# эти файлы отдают 404, результаты остаются в report.json. Отчёт прохода — dict по целям.
+# Цели с курсором (resumable, каталоги обследований) проходятся частями по max_per_pass записей:
+# курсор — путь последнего пройденного каталога, хранится в state_path между проходами и перезапусками,
+# следующий проход продолжает с него. Квота проверяется, когда круг по дереву завершён.
+import asyncio
+import fnmatch
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+STALE_TMP_S = 3600  # недописанные .tmp от упавших записей
+
+
+class Entry:
+    __slots__ = ("key", "path", "size", "mtime", "pos")
+
+    def __init__(self, key: str, path: Path, size: int, mtime: float, pos: Tuple[str, ...] = ()):
+        self.key, self.path, self.size, self.mtime = key, path, size, mtime
+        self.pos = pos  # место в порядке обхода для курсора (у целей с resumable)
+
+
+class Policy:
+    def __init__(self, ttl_s: float = 0, max_bytes: int = 0, compact_after_s: float = 0,
+                 compact_patterns: Sequence[str] = ()):
+        self.ttl_s = ttl_s              # 0 — без TTL
+        self.max_bytes = max_bytes      # 0 — без квоты
+        self.compact_after_s = compact_after_s
+        self.compact_patterns = tuple(compact_patterns)
+
+
+class FilesTarget:
+    # плоский каталог файлов (временные фото, готовые отчёты): запись = файл
+    resumable = False
+
+    def __init__(self, name: str, root: Path, pattern: str = "*"):
+        self.name, self.root, self.pattern = name, Path(root), pattern
+
+    def entries(self) -> Iterator[Entry]:
+        if not self.root.is_dir():
+            return
+        with os.scandir(self.root) as it:
+            for e in it:
+                try:
+                    if not e.is_file(follow_symlinks=False) or not fnmatch.fnmatch(e.name, self.pattern):
+                        continue
+                    st = e.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                yield Entry(e.name, Path(e.path), st.st_size, st.st_mtime)
+
+    def delete(self, entry: Entry) -> int:
+        entry.path.unlink(missing_ok=True)
+        return entry.size
+
+    def compact(self, entry: Entry, patterns: Sequence[str]) -> int:
+        return 0
+
+
+class ExamDirsTarget:
+    # каталоги обследований LocalShardedStorage: запись = каталог, возраст — по последнему изменению
+    resumable = True
+
+    def __init__(self, name: str, storage):
+        self.name, self.storage = name, storage
+
+    def entries(self, after: Sequence[str] = ()) -> Iterator[Entry]:
+        now = time.time()
+        for exam_id, d in (self.storage.iter_exams(after) if after else self.storage.iter_exams()):
+            if d is None:
+                continue
+            size, mtime = 0, 0.0
+            try:
+                with os.scandir(d) as it:
+                    for e in it:
+                        if not e.is_file(follow_symlinks=False):
+                            continue
+                        st = e.stat(follow_symlinks=False)
+                        if e.name.endswith(".tmp") and now - st.st_mtime > STALE_TMP_S:
+                            Path(e.path).unlink(missing_ok=True)
+                            continue
+                        size += st.st_size
+                        mtime = max(mtime, st.st_mtime)
+            except OSError:
+                continue
+            yield Entry(exam_id, d, size, mtime or now, d.relative_to(self.storage.root).parts)
+
+    def delete(self, entry: Entry) -> int:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        forget = getattr(self.storage, "forget_dir", None)
+        if forget is not None:
+            forget(entry.key)
+        return entry.size
+
+    def compact(self, entry: Entry, patterns: Sequence[str]) -> int:
+        freed = 0
+        with os.scandir(entry.path) as it:
+            for e in it:
+                if e.is_file(follow_symlinks=False) and any(fnmatch.fnmatch(e.name, p) for p in patterns):
+                    size = e.stat(follow_symlinks=False).st_size
+                    Path(e.path).unlink(missing_ok=True)
+                    freed += size
+        # mtime каталога не трогаем: возраст считается по оставшимся файлам
+        entry.size -= freed
+        return freed
+
+
+class RetentionService:
+    def __init__(self, targets: List[Tuple[Any, Policy]], batch: int = 200, pause_s: float = 0.05,
+                 max_per_pass: int = 0, state_path: Optional[Path] = None):
+        self.targets = targets
+        self.batch = max(1, batch)
+        self.pause_s = pause_s
+        self.max_per_pass = max(0, max_per_pass)  # 0 — каждая цель целиком за проход
+        self.state_path = Path(state_path) if state_path is not None else None
+        self._cursors: Dict[str, List[str]] = self._load_cursors()
+        # выжившие записи текущего круга (для квоты); после перезапуска круг досчитывается без
+        # уже пройденной части — квота тогда видит меньше, чем есть, и лишнего не удаляет
+        self._kept: Dict[str, List[Tuple[float, int, Entry]]] = {}
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.totals = {"runs": 0, "deleted": 0, "compacted": 0, "bytes_reclaimed": 0}
+        self._lock = threading.Lock()  # один проход за раз
+        self._ops = 0
+
+    def _tick(self) -> None:
+        self._ops += 1
+        if self._ops % self.batch == 0 and self.pause_s > 0:
+            time.sleep(self.pause_s)
+
+    def _load_cursors(self) -> Dict[str, List[str]]:
+        try:
+            cursors = json.loads(self.state_path.read_text("utf-8"))["cursors"]
+            return {str(k): [str(p) for p in v] for k, v in cursors.items()}
+        except Exception:
+            return {}  # нет файла или он битый — круг с начала
+
+    def _save_cursors(self) -> None:
+        if self.state_path is None:
+            return
+        tmp = self.state_path.with_name(f".{self.state_path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps({"cursors": self._cursors}), "utf-8")
+            tmp.replace(self.state_path)
+        except OSError:
+            pass  # курсор — только оптимизация: без него следующий круг начнётся сначала
+
+    def _run_target(self, target, policy: Policy, now: float) -> Dict[str, Any]:
+        rep = {"scanned": 0, "deleted": 0, "compacted": 0, "bytes_reclaimed": 0,
+               "bytes_kept": 0, "errors": 0}
+        limit = self.max_per_pass if getattr(target, "resumable", False) else 0
+        if limit:
+            after = self._cursors.get(target.name)
+            entries = target.entries(after) if after else target.entries()
+            kept = self._kept.setdefault(target.name, [])
+        else:
+            entries, kept = target.entries(), []
+        last: Tuple[str, ...] = ()
+        for entry in entries:
+            if limit and rep["scanned"] >= limit:
+                # круг не закончен: курсор на последнем пройденном, квота — в конце круга
+                entries.close()
+                self._cursors[target.name] = list(last)
+                rep["cursor"] = "/".join(last)
+                rep["bytes_kept"] = sum(size for _, size, _ in kept)
+                return rep
+            self._tick()
+            last = entry.pos
+            rep["scanned"] += 1
+            age = now - entry.mtime
+            try:
+                if policy.ttl_s and age > policy.ttl_s:
+                    rep["bytes_reclaimed"] += target.delete(entry)
+                    rep["deleted"] += 1
+                    self._tick()
+                    continue
+                if policy.compact_after_s and policy.compact_patterns and age > policy.compact_after_s:
+                    freed = target.compact(entry, policy.compact_patterns)
+                    if freed:
+                        rep["bytes_reclaimed"] += freed
+                        rep["compacted"] += 1
+                        self._tick()
+            except OSError:
+                rep["errors"] += 1
+            kept.append((entry.mtime, entry.size, entry))
+
+        if limit:
+            self._cursors.pop(target.name, None)
+            self._kept.pop(target.name, None)
+        total = sum(size for _, size, _ in kept)
+        if policy.max_bytes and total > policy.max_bytes:
+            kept.sort(key=lambda t: t[0])
+            i = 0
+            while total > policy.max_bytes and i < len(kept):
+                _, size, entry = kept[i]
+                i += 1
+                try:
+                    rep["bytes_reclaimed"] += target.delete(entry)
+                    rep["deleted"] += 1
+                    total -= size
+                except OSError:
+                    rep["errors"] += 1
+                self._tick()
+        rep["bytes_kept"] = total
+        return rep
+
+    def run_once(self) -> Dict[str, Any]:
+        with self._lock:
+            t0 = time.time()
+            report: Dict[str, Any] = {"started_at": int(t0), "targets": {}}
+            for target, policy in self.targets:
+                report["targets"][target.name] = self._run_target(target, policy, t0)
+            self._save_cursors()
+            report["took_ms"] = int((time.time() - t0) * 1000)
+            self.totals["runs"] += 1
+            for r in report["targets"].values():
+                self.totals["deleted"] += r["deleted"]
+                self.totals["compacted"] += r["compacted"]
+                self.totals["bytes_reclaimed"] += r["bytes_reclaimed"]
+            self.last_report = report
+            return report
+
+    def status(self) -> Dict[str, Any]:
+        return {"totals": dict(self.totals), "last": self.last_report}
+
+
+def env_seconds(name: str, default: float, unit: float = 1.0) -> float:
+    # значение в единицах unit (например, дни) -> секунды; 0 — выключено
+    try:
+        return max(0.0, float(os.environ.get(name, str(default)))) * unit
+    except Exception:
+        return default * unit
+
+
+def env_bytes_mb(name: str, default_mb: float) -> int:
+    try:
+        return int(max(0.0, float(os.environ.get(name, str(default_mb)))) * 1024 * 1024)
+    except Exception:
+        return int(default_mb * 1024 * 1024)
+
+
+async def run_periodically(service: RetentionService, interval_s: float,
+                           on_report: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+    # фоновая задача сервера: проход в отдельном потоке, цикл событий не блокируется
+    while True:
+        try:
+            report = await asyncio.to_thread(service.run_once)
+        except Exception as e:
+            # следующий проход через interval_s; ошибка видна в status()
+            report = service.last_report = {"started_at": int(time.time()), "error": f"{type(e).__name__}: {e}"}
+        if on_report is not None:
+            on_report(report)
+        await asyncio.sleep(interval_s)
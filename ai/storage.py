@@ -0,0 +1,234 @@
+# Хранилище артефактов обследования (снимки, теплокарты, отчёты) за одним интерфейсом.
+# local  — шардированная раскладка <root>/<h[:2]>/<h[2:4]>/<exam_id>/<name>, h = sha1(exam_id):
+#          в каталоге не больше 256 подкаталогов, каталог обследования создаётся один раз на процесс.
+#          Старые плоские <root>/<exam_id>/ читаются как раньше.
+# object — адаптер объектного хранилища (put_object/get_object/head_object/delete_object по ключу);
+#          LocalObjectStore — локальная замена для разработки и проверок, S3-клиент подключается так же.
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator, Optional, Protocol, Sequence, Tuple
+
+
+_SHARD = re.compile("[0-9a-f]{2}")  # каталог шарда: два hex-символа sha1(exam_id)
+
+
+def check_name(v: str) -> str:
+    # exam_id и имя файла приходят от клиента: только один сегмент пути
+    if not v or v in (".", "..") or "/" in v or "\\" in v or "\0" in v:
+        raise ValueError(f"bad storage name: {v!r}")
+    return v
+
+
+def check_exam_id(v: str) -> str:
+    # имена на "." и "_" в корне — служебные каталоги (_cache, _objects, …), не обследования
+    check_name(v)
+    if v.startswith((".", "_")):
+        raise ValueError(f"reserved exam_id: {v!r}")
+    return v
+
+
+def media_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    # через temp + rename: читатель не видит недописанный файл, жёсткие ссылки (кэш) не портятся
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+
+class ExamStorage(ABC):
+    # бэкенд без любого из абстрактных методов падает TypeError уже при создании
+    @abstractmethod
+    def write_bytes(self, exam_id: str, name: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    def read_bytes(self, exam_id: str, name: str) -> bytes: ...  # FileNotFoundError, если нет
+
+    @abstractmethod
+    def exists(self, exam_id: str, name: str) -> bool: ...
+
+    def local_path(self, exam_id: str, name: str) -> Optional[Path]:
+        # путь на локальном диске (для FileResponse / жёстких ссылок) или None у удалённых хранилищ
+        return None
+
+    def link_file(self, exam_id: str, name: str, src: Path) -> None:
+        self.write_bytes(exam_id, name, Path(src).read_bytes())
+
+    @abstractmethod
+    def iter_exams(self) -> Iterator[Tuple[str, Optional[Path]]]: ...
+
+    def write_text(self, exam_id: str, name: str, text: str) -> None:
+        self.write_bytes(exam_id, name, text.encode("utf-8"))
+
+
+class LocalShardedStorage(ExamStorage):
+    def __init__(self, root: Path, levels: int = 2, dir_cache_max: int = 100_000):
+        self.root = Path(root)
+        self.levels = max(0, min(4, int(levels)))
+        self._made = set()  # каталоги обследований, уже созданные этим процессом
+        self._made_max = dir_cache_max
+        self._lock = threading.Lock()
+
+    def exam_dir(self, exam_id: str) -> Path:
+        check_exam_id(exam_id)
+        h = hashlib.sha1(exam_id.encode("utf-8")).hexdigest()
+        d = self.root
+        for i in range(self.levels):
+            d = d / h[2 * i: 2 * i + 2]
+        return d / exam_id
+
+    def _ensure_dir(self, exam_id: str) -> Path:
+        d = self.exam_dir(exam_id)
+        if exam_id not in self._made:
+            d.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                if len(self._made) >= self._made_max:
+                    self._made.clear()
+                self._made.add(exam_id)
+        return d
+
+    def local_path(self, exam_id: str, name: str) -> Path:
+        p = self.exam_dir(exam_id) / check_name(name)
+        if self.levels and not p.exists():
+            legacy = self.root / exam_id / name
+            if legacy.exists():
+                return legacy
+        return p
+
+    def write_bytes(self, exam_id: str, name: str, data: bytes) -> None:
+        d = self._ensure_dir(exam_id)
+        try:
+            _atomic_write(d / check_name(name), data)
+        except FileNotFoundError:
+            # каталог удалили извне (очистка хранения) — создать заново
+            self._made.discard(exam_id)
+            _atomic_write(self._ensure_dir(exam_id) / name, data)
+
+    def read_bytes(self, exam_id: str, name: str) -> bytes:
+        return self.local_path(exam_id, name).read_bytes()
+
+    def exists(self, exam_id: str, name: str) -> bool:
+        return self.local_path(exam_id, name).is_file()
+
+    def link_file(self, exam_id: str, name: str, src: Path) -> None:
+        dst = self._ensure_dir(exam_id) / check_name(name)
+        try:
+            if os.path.samefile(src, dst):
+                return  # уже та же ссылка; rename между ссылками на один inode ничего не делает
+        except OSError:
+            pass
+        tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.link(src, tmp)
+        except OSError:
+            tmp.write_bytes(Path(src).read_bytes())
+        tmp.replace(dst)
+
+    def forget_dir(self, exam_id: str) -> None:
+        self._made.discard(exam_id)
+
+    def iter_exams(self, after: Sequence[str] = ()) -> Iterator[Tuple[str, Optional[Path]]]:
+        # (exam_id, каталог) по возрастанию пути от root; служебные каталоги корня (_audit, _cache, …)
+        # пропускаются. after — путь от root последнего пройденного каталога (части пути): он и всё,
+        # что раньше, пропускаются без захода в шарды — так очистка продолжает проход с места остановки.
+        if not self.root.exists():
+            return
+        def walk(d: Path, depth: int, after: Sequence[str]):
+            with os.scandir(d) as it:
+                names = sorted(e.name for e in it
+                               if e.is_dir(follow_symlinks=False) and not e.name.startswith((".", "_")))
+            for name in names:
+                if after and name < after[0]:
+                    continue
+                rest = after[1:] if after and name == after[0] else ()
+                if depth == self.levels or (depth == 0 and not _SHARD.fullmatch(name)):
+                    # каталог обследования (при depth 0 — старая плоская раскладка)
+                    if not (after and name == after[0]):
+                        yield name, d / name
+                elif _SHARD.fullmatch(name):
+                    yield from walk(d / name, depth + 1, rest)
+        yield from walk(self.root, 0, tuple(after))
+
+
+class ObjectClient(Protocol):
+    def put_object(self, key: str, data: bytes) -> None: ...
+    def get_object(self, key: str) -> bytes: ...
+    def head_object(self, key: str) -> bool: ...
+    def delete_object(self, key: str) -> None: ...
+    def list_prefixes(self, prefix: str) -> Iterator[str]: ...
+
+
+class LocalObjectStore:
+    # локальная замена объектного хранилища: ключ -> файл под root, без семантики каталогов у вызывающего
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        parts = key.split("/")
+        for p in parts:
+            check_name(p)
+        return self.root.joinpath(*parts)
+
+    def put_object(self, key: str, data: bytes) -> None:
+        p = self._path(key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write(p, data)
+
+    def get_object(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def head_object(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def delete_object(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def list_prefixes(self, prefix: str) -> Iterator[str]:
+        d = self._path(prefix.rstrip("/")) if prefix.strip("/") else self.root
+        if d.is_dir():
+            for e in os.scandir(d):
+                if e.is_dir():
+                    yield e.name
+
+
+class ObjectStorage(ExamStorage):
+    # ключ: <prefix>/<exam_id>/<name>; каталоги не создаются вовсе
+    def __init__(self, client: ObjectClient, prefix: str = "exams"):
+        self.client = client
+        self.prefix = prefix.strip("/")
+
+    def _key(self, exam_id: str, name: str) -> str:
+        return f"{self.prefix}/{check_exam_id(exam_id)}/{check_name(name)}"
+
+    def write_bytes(self, exam_id: str, name: str, data: bytes) -> None:
+        self.client.put_object(self._key(exam_id, name), data)
+
+    def read_bytes(self, exam_id: str, name: str) -> bytes:
+        return self.client.get_object(self._key(exam_id, name))
+
+    def exists(self, exam_id: str, name: str) -> bool:
+        return self.client.head_object(self._key(exam_id, name))
+
+    def iter_exams(self) -> Iterator[Tuple[str, Optional[Path]]]:
+        for exam_id in self.client.list_prefixes(self.prefix + "/"):
+            yield exam_id, None
+
+
+def storage_from_env(root: Path) -> ExamStorage:
+    # IRIDA_STORAGE=local (по умолчанию) | object; IRIDA_STORAGE_SHARD_LEVELS; IRIDA_OBJECT_STORE_DIR
+    kind = os.environ.get("IRIDA_STORAGE", "local").strip().lower()
+    if kind == "object":
+        store_dir = os.environ.get("IRIDA_OBJECT_STORE_DIR", "").strip()
+        return ObjectStorage(LocalObjectStore(Path(store_dir) if store_dir else Path(root) / "_objects"))
+    try:
+        levels = int(os.environ.get("IRIDA_STORAGE_SHARD_LEVELS", "2"))
+    except Exception:
+        levels = 2
+    return LocalShardedStorage(Path(root), levels)
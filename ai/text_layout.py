@@ -0,0 +1,178 @@
+# Раскладка текста для PDF (reportlab canvas): выбор шрифта по покрытию глифов, перенос по словам, RTL.
+# Ширины глифов и слов кэшируются на шрифт в единицах 1/1000 кегля (без кернинга ширина строки —
+# сумма ширин символов, как у pdfmetrics.stringWidth), поэтому кегль — только множитель.
+# Перенос — один проход: ширина строки накапливается, а не пересчитывается по растущей строке.
+# RTL: арабские контекстные формы (arabic_reshaper) — один раз на абзац в логическом порядке,
+# перенос — по логическому тексту, визуальный порядок (python-bidi) — для каждой готовой строки
+# (UAX #9 переупорядочивает уже разбитые строки).
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:  # без них RTL-текст выводится в логическом порядке
+    arabic_reshaper = None
+    get_display = None
+
+_ROOT = Path(__file__).resolve().parent.parent
+FONT_DIRS = (_ROOT / "fonts", _ROOT / "iris_ai_server" / "pdf" / "fonts")
+FONT_FILES = {
+    "DejaVuSans": "DejaVuSans.ttf",
+    "NotoSansArabic": "NotoSansArabic-Regular.ttf",
+    "NotoSansHebrew": "NotoSansHebrew-Regular.ttf",
+}
+LOCALE_FONTS = {"ar": "NotoSansArabic", "fa": "NotoSansArabic", "ur": "NotoSansArabic", "he": "NotoSansHebrew"}
+DEFAULT_FONT = "DejaVuSans"
+FALLBACK_FONT = "Helvetica"  # только латиница; если ни один TTF не читается
+RTL_LANGS = ("ar", "fa", "ur", "he")
+WORD_CACHE_MAX = 20_000  # слов на шрифт
+
+_RTL_CHARS = re.compile("[\u0590-\u08ff\ufb1d-\ufdff\ufe70-\ufeff]")
+
+_lock = threading.Lock()
+_registered: Dict[str, bool] = {}
+_glyph_w: Dict[str, Dict[str, float]] = {}
+_word_w: Dict[str, Dict[str, float]] = {}
+
+
+def lang(locale: Optional[str]) -> str:
+    return (locale or "en").replace("_", "-").split("-", 1)[0].lower()
+
+
+def is_rtl(locale: Optional[str]) -> bool:
+    return lang(locale) in RTL_LANGS
+
+
+def ensure_font(name: str) -> bool:
+    # регистрация TTF один раз на процесс; битый или отсутствующий файл — False, без исключения
+    if name in _registered:
+        return _registered[name]
+    with _lock:
+        if name not in _registered:
+            ok = name in pdfmetrics.getRegisteredFontNames()
+            for d in FONT_DIRS if not ok and name in FONT_FILES else ():
+                try:
+                    pdfmetrics.registerFont(TTFont(name, str(d / FONT_FILES[name])))
+                    ok = True
+                    break
+                except Exception:
+                    continue
+            _registered[name] = ok
+    return _registered[name]
+
+
+def _covers(font: str, text: str) -> bool:
+    cw = getattr(getattr(pdfmetrics.getFont(font), "face", None), "charWidths", None)
+    if cw is None:
+        return False
+    return all(ord(ch) in cw for ch in set(text) if not ch.isspace())
+
+
+def pick_font(text: str, locale: Optional[str] = None) -> str:
+    # шрифт локали, если покрывает все символы (после арабских форм), иначе DejaVuSans, иначе Helvetica
+    shaped = _reshape(text) if _RTL_CHARS.search(text) else text
+    for name in (LOCALE_FONTS.get(lang(locale)), DEFAULT_FONT):
+        if name and ensure_font(name) and _covers(name, shaped):
+            return name
+    return DEFAULT_FONT if ensure_font(DEFAULT_FONT) else FALLBACK_FONT
+
+
+def _glyphs(font: str) -> Dict[str, float]:
+    g = _glyph_w.get(font)
+    if g is None:
+        g = _glyph_w.setdefault(font, {})
+    return g
+
+
+def _char_units(g: Dict[str, float], font: str, ch: str) -> float:
+    cw = g.get(ch)
+    if cw is None:
+        cw = g[ch] = pdfmetrics.stringWidth(ch, font, 1000)
+    return cw
+
+
+def _word_units(font: str, word: str) -> float:
+    cache = _word_w.get(font)
+    if cache is None:
+        cache = _word_w.setdefault(font, {})
+    w = cache.get(word)
+    if w is None:
+        g = _glyphs(font)
+        w = 0.0
+        for ch in word:
+            w += _char_units(g, font, ch)
+        if len(cache) >= WORD_CACHE_MAX:
+            cache.clear()
+        cache[word] = w
+    return w
+
+
+def text_width(text: str, font: str, size: float) -> float:
+    return _word_units(font, text) * size / 1000.0
+
+
+def _reshape(text: str) -> str:
+    return arabic_reshaper.reshape(text) if arabic_reshaper is not None else text
+
+
+def _split_long(word: str, max_units: float, font: str) -> List[str]:
+    # слово шире строки — по символам
+    g = _glyphs(font)
+    parts, start, acc = [], 0, 0.0
+    for i, ch in enumerate(word):
+        cw = _char_units(g, font, ch)
+        if acc + cw > max_units and i > start:
+            parts.append(word[start:i])
+            start, acc = i, 0.0
+        acc += cw
+    parts.append(word[start:])
+    return parts
+
+
+def _wrap_words(words: Sequence[str], max_units: float, font: str) -> List[str]:
+    space = _word_units(font, " ")
+    lines: List[str] = []
+    cur: List[str] = []
+    cur_w = 0.0
+    for w in words:
+        ww = _word_units(font, w)
+        if ww > max_units:
+            if cur:
+                lines.append(" ".join(cur))
+            *full, last = _split_long(w, max_units, font)
+            lines.extend(full)
+            cur, cur_w = [last], _word_units(font, last)
+            continue
+        add = ww + space if cur else ww
+        if cur and cur_w + add > max_units:
+            lines.append(" ".join(cur))
+            cur, cur_w = [w], ww
+        else:
+            cur.append(w)
+            cur_w += add
+    if cur:
+        lines.append(" ".join(cur))
+    return lines
+
+
+def wrap(text: str, max_width: float, font: str, size: float, locale: Optional[str] = None) -> List[str]:
+    # -> строки в визуальном порядке, готовые для drawString / drawRightString (RTL)
+    ensure_font(font)
+    max_units = max_width * 1000.0 / size
+    base_dir = "R" if is_rtl(locale) else "L"
+    out: List[str] = []
+    for para in str(text).split("\n"):
+        bidi = _RTL_CHARS.search(para) is not None
+        if bidi:
+            para = _reshape(para)
+        lines = _wrap_words(para.split(), max_units, font) or [""]
+        if bidi and get_display is not None:
+            lines = [get_display(line, base_dir=base_dir) for line in lines]
+        out.extend(lines)
+    return out
@@ -0,0 +1,89 @@
+# Приём загрузок для обоих серверов: потоковый лимит размера тела и проверка сигнатуры.
+# Тело запроса считается по мере поступления (ASGI receive): заявленный Content-Length сверх лимита —
+# 413 до чтения тела, иначе 413, как только прочитано больше лимита, не дожидаясь, пока
+# multipart-парсер допишет файл. Сам файл читается кусками после проверки сигнатуры JPEG/PNG.
+# Ответ на отказ один для всех путей: {"status": "error", "reason", "max_upload_mb"[, "field"]}.
+from typing import Dict, Optional
+
+from fastapi import FastAPI, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+MAX_UPLOAD_MB = 12
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_CHUNK = 256 * 1024
+UPLOAD_FORM_SLACK = 64 * 1024  # текстовые поля формы и заголовки частей
+_IMAGE_MAGIC = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")
+
+
+class UploadRejected(StarletteHTTPException):
+    # наследник HTTPException: FastAPI пропускает его из разбора формы как есть (а не 400)
+    def __init__(self, status_code: int, reason: str, field: Optional[str] = None):
+        super().__init__(status_code=status_code, detail=reason)
+        self.reason = reason
+        self.field = field
+
+
+def rejection_body(reason: str, field: Optional[str] = None) -> Dict[str, object]:
+    body: Dict[str, object] = {"status": "error", "reason": reason, "max_upload_mb": MAX_UPLOAD_MB}
+    if field is not None:
+        body["field"] = field
+    return body
+
+
+async def upload_rejected_handler(request, exc: UploadRejected):
+    return JSONResponse(rejection_body(exc.reason, exc.field), status_code=exc.status_code)
+
+
+class UploadLimitMiddleware:
+    # files_per_path: путь POST -> сколько файлов в форме (лимит тела = файлы × MAX_UPLOAD_BYTES + запас)
+    def __init__(self, app, files_per_path: Dict[str, int]):
+        self.app = app
+        self.files_per_path = files_per_path
+
+    async def __call__(self, scope, receive, send):
+        n_files = self.files_per_path.get(scope.get("path", "")) if scope["type"] == "http" else None
+        if not n_files or scope.get("method") != "POST":
+            return await self.app(scope, receive, send)
+
+        limit = n_files * MAX_UPLOAD_BYTES + UPLOAD_FORM_SLACK
+        for k, v in scope.get("headers", []):
+            if k == b"content-length" and v.isdigit() and int(v) > limit:
+                resp = JSONResponse(rejection_body("too_large"), status_code=413)
+                return await resp(scope, receive, send)
+
+        seen = 0
+
+        async def limited_receive():
+            nonlocal seen
+            msg = await receive()
+            if msg["type"] == "http.request":
+                seen += len(msg.get("body", b""))
+                if seen > limit:
+                    raise UploadRejected(413, "too_large")
+            return msg
+
+        await self.app(scope, limited_receive, send)
+
+
+def install_upload_limits(app: FastAPI, files_per_path: Dict[str, int]) -> None:
+    app.add_middleware(UploadLimitMiddleware, files_per_path=files_per_path)
+    app.add_exception_handler(UploadRejected, upload_rejected_handler)
+
+
+async def read_upload(file: UploadFile, limit: int = MAX_UPLOAD_BYTES, field: str = "file") -> bytes:
+    first = await file.read(UPLOAD_CHUNK)
+    if not first.startswith(_IMAGE_MAGIC):
+        raise UploadRejected(415, "unsupported_media", field)
+    chunks, total = [first], len(first)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise UploadRejected(413, "too_large", field)
+        chunks.append(chunk)
+    # bytes, а не memoryview: BytesIO разделяет буфер неизменяемых bytes без копии,
+    # и bytes передаются в пул процессов через pickle
+    return first if len(chunks) == 1 else b"".join(chunks)
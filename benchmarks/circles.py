@@ -0,0 +1,54 @@
+# Точность и время detect_circles: полный проход против пирамиды на фикстурах.
+#   python -m benchmarks.circles            # код возврата 1, если хоть одна фикстура (любой режим)
+#                                           # найдена дальше допуска от истинных окружностей; в таблице — макс. ошибки
+import argparse
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from ai.iris_geom import detect_circles
+from benchmarks.fixtures import fixture_set
+
+
+def _errors(found, truth):
+    center = float(np.hypot(found.center[0] - truth.center[0], found.center[1] - truth.center[1]))
+    return center, abs(found.r_pupil - truth.r_pupil), abs(found.r_iris - truth.r_iris)
+
+
+def run(tolerance_px: float = 4.0, tolerance_rel: float = 0.01) -> int:
+    # допуск на каждую фикстуру и режим: ошибка центра и обоих радиусов против truth из synthetic_eye
+    # не больше max(tolerance_px, tolerance_rel * r_iris)
+    stats = defaultdict(lambda: {"ms": [], "err": [], "miss": 0})
+    for size, img, truth in fixture_set():
+        bound = max(tolerance_px, tolerance_rel * truth.r_iris)
+        for mode in ("full", "pyramid"):
+            t0 = time.perf_counter()
+            found = detect_circles(img, pyramid=(mode == "pyramid"))
+            stats[(size, mode)]["ms"].append((time.perf_counter() - t0) * 1000)
+            err = _errors(found, truth)
+            stats[(size, mode)]["err"].append(err)
+            if max(err) > bound:
+                stats[(size, mode)]["miss"] += 1
+                print(f"  !! {size[0]}x{size[1]} {mode}: truth {truth}, found {found}, "
+                      f"error {max(err):.1f}px > {bound:.1f}px")
+
+    failed = False
+    print(f"{'size':>10} {'mode':>8} {'ms':>8} {'center':>7} {'r_pup':>6} {'r_iris':>6} {'miss':>5}")
+    for size in sorted({k[0] for k in stats}):
+        for mode in ("full", "pyramid"):
+            s = stats[(size, mode)]
+            err = np.max(s["err"], axis=0)
+            print(f"{size[0]:>5}x{size[1]:<4} {mode:>8} {np.median(s['ms']):8.1f} "
+                  f"{err[0]:7.2f} {err[1]:6.2f} {err[2]:6.2f} {s['miss']:>5}")
+            failed = failed or s["miss"] > 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tolerance-px", type=float, default=4.0)
+    ap.add_argument("--tolerance-rel", type=float, default=0.01, help="share of the true iris radius")
+    args = ap.parse_args()
+    sys.exit(run(args.tolerance_px, args.tolerance_rel))
@@ -0,0 +1,35 @@
+# Детерминированные синтетические снимки радужки с известными окружностями
+from typing import List, Tuple
+
+import numpy as np
+import cv2
+
+from ai.iris_geom import Circles
+
+# (w, h): от превью камеры до 12 Мп кадра телефона
+FIXTURE_SIZES = [(640, 480), (1600, 1200), (2400, 1800), (4000, 3000)]
+FIXTURE_SEEDS = range(6)
+
+
+def synthetic_eye(w: int, h: int, seed: int = 0) -> Tuple[np.ndarray, Circles]:
+    rng = np.random.default_rng(seed)
+    s = min(h, w)
+    cx = w // 2 + int(rng.integers(-s // 24, s // 24))
+    cy = h // 2 + int(rng.integers(-s // 24, s // 24))
+    r_iris = int(s * rng.uniform(0.34, 0.40))
+    r_pupil = int(s * rng.uniform(0.10, 0.14))
+
+    img = np.full((h, w, 3), 200, np.float32)
+    cv2.circle(img, (cx, cy), r_iris, (90, 110, 60), -1)
+    yy, xx = np.mgrid[:h, :w]
+    ang = np.arctan2(yy - cy, xx - cx)
+    tex = 20 * np.sin(ang * 37) + rng.normal(0, 12, (h, w))
+    inside = (xx - cx) ** 2 + (yy - cy) ** 2 < r_iris ** 2
+    img[inside] += tex[inside, None]
+    img = img.clip(0, 255).astype(np.uint8)
+    cv2.circle(img, (cx, cy), r_pupil, (15, 15, 15), -1)
+    return img, Circles(center=(cx, cy), r_pupil=r_pupil, r_iris=r_iris)
+
+
+def fixture_set(sizes=FIXTURE_SIZES, seeds=FIXTURE_SEEDS) -> List[Tuple[Tuple[int, int], np.ndarray, Circles]]:
+    return [((w, h), *synthetic_eye(w, h, seed)) for (w, h) in sizes for seed in seeds]
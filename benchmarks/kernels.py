@@ -0,0 +1,213 @@
+# Микробенчмарки горячих путей: геометрия, ядро качества, теплокарта, PDF-отчёты.
+#   python -m benchmarks.kernels run [--sizes 640x480,1600x1200] [--repeat 5] [--save benchmarks/baseline.json]
+#   python -m benchmarks.kernels compare benchmarks/baseline.json [current.json] [--threshold 0.25]
+# Время — медиана repeat прогонов после прогрева; пик памяти — отдельный прогон под tracemalloc
+# (учитывает numpy и Python, но не внутренние буферы OpenCV). Базовая линия зависит от машины:
+# сравнивать только замеры с одного хоста.
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# импорт серверных модулей создаёт каталоги данных (ai_inbox, ai_audit, каталог PDF) —
+# при замерах они во временном каталоге, а не в дереве репозитория
+_DATA_DIR = Path(tempfile.mkdtemp(prefix="irida_bench_data_"))
+atexit.register(shutil.rmtree, _DATA_DIR, ignore_errors=True)
+os.environ["IRIDA_INBOX_DIR"] = str(_DATA_DIR / "ai_inbox")
+os.environ["IRIDA_AUDIT_DIR"] = str(_DATA_DIR / "ai_audit")
+os.environ["IRIS_REPORT_DIR"] = str(_DATA_DIR / "reports")
+
+import irida_ai_server as srv  # noqa: E402
+from ai import text_layout
+from ai.atlas_map import zone_stats
+from ai.iris_geom import detect_circles, summarize_eye, unwrap_iris
+from ai.storage import LocalShardedStorage
+from benchmarks.fixtures import FIXTURE_SIZES, synthetic_eye
+from iris_ai_server.pdf import engine_v2
+from iris_ai_server.pdf.photos import photo_for_pdf
+
+DEFAULT_SIZES = [(640, 480), (1600, 1200), (4000, 3000)]
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+NOISE_FLOOR_MS = 0.5  # меньшие абсолютные разницы — шум таймера, не регрессия
+
+
+def _parse_sizes(s: str) -> List[Tuple[int, int]]:
+    out = []
+    for part in s.split(","):
+        w, h = part.lower().split("x")
+        out.append((int(w), int(h)))
+    return out
+
+
+def _cases(size: Tuple[int, int], work: Path) -> List[Tuple[str, Callable[[], Any]]]:
+    # Входы готовятся заранее: в замер попадает только сам вызов
+    w, h = size
+    bgr, truth = synthetic_eye(w, h, seed=0)
+    pil = Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+    strip_gray = cv2.cvtColor(unwrap_iris(bgr, truth), cv2.COLOR_BGR2GRAY)
+    scored = srv._score_map_and_features(pil)
+    zone_batch = np.stack([scored["zone_scores"]] * 64)  # 32 обследования по два глаза
+
+    exam_id = f"bench_{w}x{h}"
+    heatmaps = {side: srv._save_heatmap(exam_id, side, scored["score_array"]) for side in ("left", "right")}
+    eye = {"quality": scored["quality"], "quality_flags": srv._flags_quality(scored["quality"]),
+           "top_zones": srv._top_flags(scored["zone_scores"], srv.TOP_ZONES_K), "score_map": "saved"}
+    result = {"exam_id": exam_id, "age": 40, "gender": "F", "task_received": "", "left": eye, "right": dict(eye)}
+    result["text_summary"] = srv._synthesize_text(result)
+
+    photo = work / f"photo_{w}x{h}.jpg"
+    pil.save(photo, format="JPEG", quality=95)
+    photo_bytes = photo.read_bytes()
+    pdf_photo = photo_for_pdf(photo_bytes, pil)
+    findings = " ".join([result["text_summary"]] * max(1, w // 40))  # длина текста растёт с размером кейса
+    font = text_layout.pick_font(findings, "ru")
+    v2_eye = {"brightness": 0.75, "glare": 0.0, "sharpness": 1.0,
+              "diagnosis": "Спокойная структура радужки.", "recommendations": "Контроль сна."}
+
+    return [
+        ("detect_circles", lambda: detect_circles(bgr)),
+        ("detect_circles_pyramid", lambda: detect_circles(bgr, pyramid=True)),
+        ("unwrap_iris", lambda: unwrap_iris(bgr, truth)),
+        ("summarize_eye", lambda: summarize_eye(bgr)),
+        ("zone_stats", lambda: zone_stats(strip_gray)),
+        ("basic_quality", lambda: srv._basic_quality(pil)),
+        ("score_map_and_features", lambda: srv._score_map_and_features(pil)),
+        ("top_flags_batch", lambda: srv._top_flags(zone_batch, srv.TOP_ZONES_K)),
+        ("save_heatmap", lambda: srv._save_heatmap(exam_id, "left", scored["score_array"])),
+        ("save_report_pdf", lambda: srv._save_report_pdf(exam_id, result)),
+        ("wrap_text", lambda: text_layout.wrap(findings, 523, font, 10, "ru")),
+        ("render_report_pdf", lambda: srv._render_report_pdf(exam_id, result, heatmaps)),
+        ("photo_for_pdf", lambda: photo_for_pdf(photo_bytes, pil)),
+        ("generate_pdf_v2", lambda: engine_v2.generate_pdf_v2(
+            v2_eye, v2_eye, "Левый глаз: норма. Правый глаз: норма.",
+            left_photo=pdf_photo, right_photo=pdf_photo)),
+    ]
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    fn()  # прогрев: кэши, ленивые импорты, регистрация шрифтов
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3),
+            "peak_mb": round(peak / 2**20, 2)}
+
+
+def run(sizes=DEFAULT_SIZES, repeat: int = 5, only: str = "") -> Dict[str, Any]:
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory(prefix="irida_bench_") as tmp:
+        work = Path(tmp)
+        # артефакты сервера и generate_pdf_v2 (REPORT_DIR, лог на каждый отчёт) — во временный каталог
+        report_dir, log_fn, storage = engine_v2.REPORT_DIR, engine_v2.log, srv.STORAGE
+        engine_v2.REPORT_DIR, engine_v2.log = str(work), lambda msg: None
+        srv.STORAGE = LocalShardedStorage(work / "inbox")
+        try:
+            for size in sizes:
+                for name, fn in _cases(size, work):
+                    if only and only not in name:
+                        continue
+                    key = f"{name}@{size[0]}x{size[1]}"
+                    results[key] = _measure(fn, repeat)
+                    r = results[key]
+                    print(f"{key:<40} {r['median_ms']:10.2f} ms  (min {r['min_ms']:.2f})  peak {r['peak_mb']:8.2f} MB")
+        finally:
+            engine_v2.REPORT_DIR, engine_v2.log, srv.STORAGE = report_dir, log_fn, storage
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "sizes": [f"{w}x{h}" for w, h in sizes],
+        },
+        "results": results,
+    }
+
+
+def compare(base: Dict[str, Any], cur: Dict[str, Any], threshold: float, mem_threshold: float) -> int:
+    # ядра, которых нет в базовой линии, не проверяются, но перечисляются: базовую линию пора обновить
+    failed = 0
+    print(f"{'kernel':<40} {'base ms':>10} {'now ms':>10} {'Δ':>8} {'base MB':>9} {'now MB':>9}")
+    for key, b in base["results"].items():
+        c = cur["results"].get(key)
+        if c is None:
+            print(f"{key:<40} {'missing in current run':>30}")
+            continue
+        dt = c["median_ms"] / b["median_ms"] - 1.0 if b["median_ms"] > 0 else 0.0
+        slow = dt > threshold and c["median_ms"] - b["median_ms"] > NOISE_FLOOR_MS
+        fat = b["peak_mb"] > 0 and c["peak_mb"] > b["peak_mb"] * (1.0 + mem_threshold) and c["peak_mb"] - b["peak_mb"] > 1.0
+        mark = "  !! time" if slow else ""
+        mark += "  !! memory" if fat else ""
+        failed += bool(slow or fat)
+        print(f"{key:<40} {b['median_ms']:10.2f} {c['median_ms']:10.2f} {dt:+8.1%} {b['peak_mb']:9.2f} {c['peak_mb']:9.2f}{mark}")
+    if failed:
+        print(f"{failed} kernel(s) regressed (time > +{threshold:.0%} or peak memory > +{mem_threshold:.0%})")
+    new = [key for key in cur["results"] if key not in base["results"]]
+    for key in new:
+        c = cur["results"][key]
+        print(f"{key:<40} {'-':>10} {c['median_ms']:10.2f} {'':>8} {'-':>9} {c['peak_mb']:9.2f}  ?? not in baseline")
+    if new:
+        print(f"{len(new)} kernel(s) missing from the baseline, not checked: re-run with --save to include them")
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.kernels")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="measure kernels, optionally save a baseline")
+    r.add_argument("--sizes", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SIZES),
+                   help=f"comma-separated WxH (fixtures: {','.join(f'{w}x{h}' for w, h in FIXTURE_SIZES)})")
+    r.add_argument("--repeat", type=int, default=5)
+    r.add_argument("--only", default="", help="substring filter on kernel name")
+    r.add_argument("--save", nargs="?", const=str(DEFAULT_BASELINE), default=None)
+    c = sub.add_parser("compare", help="compare a run against a saved baseline; exit 1 on regression")
+    c.add_argument("baseline", nargs="?", default=str(DEFAULT_BASELINE))
+    c.add_argument("current", nargs="?", default=None, help="saved run to compare; default: run now")
+    c.add_argument("--threshold", type=float, default=0.25, help="allowed median slowdown, fraction")
+    c.add_argument("--mem-threshold", type=float, default=0.25, help="allowed peak memory growth, fraction")
+    c.add_argument("--repeat", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "run":
+        out = run(_parse_sizes(args.sizes), args.repeat, args.only)
+        if args.save:
+            Path(args.save).write_text(json.dumps(out, indent=2, ensure_ascii=False), encoding="utf-8")
+            print(f"saved {args.save}")
+        return 0
+
+    base = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    if args.current:
+        cur = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    else:
+        meta = base["meta"]
+        cur = run(_parse_sizes(",".join(meta["sizes"])), args.repeat or meta.get("repeat", 5))
+    return compare(base, cur, args.threshold, args.mem_threshold)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
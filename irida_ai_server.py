@@ -2,48 +2,67 @@ from __future__ import annotations
 
 from fastapi import FastAPI, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response
+from starlette.background import BackgroundTask
+from fastapi.responses import FileResponse
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from PIL import Image
 import numpy as np
+import cv2
 import json
 from io import BytesIO
 
-# --- reportlab для PDF (Helvetica-только) ---
+# --- reportlab для PDF (шрифт и перенос — ai/text_layout) ---
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
+from reportlab.lib.utils import ImageReader
 
 import time
 import os
-BASE_DIR = Path(__file__).parent.resolve()
-INBOX = BASE_DIR / "ai_inbox"
-
-def _audit_save(exam_dir: "Path", payload: dict, kind: str) -> "Path":
-    exam_dir = Path(exam_dir)
-    exam_dir.mkdir(parents=True, exist_ok=True)
-
-    ts_ms = int(time.time() * 1000)
-    pid = os.getpid()
-
-    out = exam_dir / f"{ts_ms}_{pid}_{kind}_audit.json"
-    tmp = exam_dir / f".{out.name}.tmp"
 
-    import json
-    data = json.dumps(payload, ensure_ascii=False, indent=2, sort_keys=True)
-
-    tmp.write_text(data, encoding="utf-8")
-    tmp.replace(out)
-    return out
+from ai.ingest import decode_image, max_side_from_env
+from ai.quality_kernel import fused_quality
+from ai.heatmap import FORMATS as HEATMAP_FORMATS, encode_heatmap
+from ai.storage import check_exam_id, check_name, media_type, storage_from_env
+from ai import text_layout
+from ai.atlas_map import zone_names, zone_stats
+from ai.iris_geom import Circles, detect_circles, unwrap_iris
 
+BASE_DIR = Path(__file__).parent.resolve()
+INBOX = Path(os.environ.get("IRIDA_INBOX_DIR", "").strip() or BASE_DIR / "ai_inbox")
 
 INBOX.mkdir(parents=True, exist_ok=True)
-
-MAX_UPLOAD_MB = 12
+# Файлы обследований — через STORAGE (шарды ai_inbox/ab/cd/<exam_id>/ или объектное хранилище,
+# см. ai/storage.py); служебный ai_inbox/_cache — напрямую, журнал аудита — в AUDIT_DIR
+STORAGE = storage_from_env(INBOX)
+
+# Рабочее разрешение декодирования по длинной стороне, 0 — полное.
+# Метрики резкости зависят от масштаба: включать вместе с перекалибровкой порогов.
+ANALYZE_MAX_SIDE = max_side_from_env("IRIDA_ANALYZE_MAX_SIDE", 0)
+ANALYZE_EYE_MAX_SIDE = max_side_from_env("IRIDA_ANALYZE_EYE_MAX_SIDE", 0)
 app = FastAPI()
 
+# --- Метрики (Prometheus, GET /metrics) ---
+# Стадии из пула CPU меряются в воркере (timed) и возвращаются вместе с результатом задачи.
+from ai.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ai.metrics import Registry, RequestMetricsMiddleware, observe_stages, timed
+
+_metrics = Registry()
+STAGE_SECONDS = _metrics.histogram(
+    "irida_stage_seconds",
+    "Stage latency: upload_read, decode, quality, geometry, heatmap, report_json, report_txt, report_pdf, report_archive, audit",
+    ["stage"],
+)
+REQUEST_SECONDS = _metrics.histogram("irida_request_seconds", "Request latency by path", ["path"])
+REQUESTS = _metrics.counter("irida_requests_total", "Requests by path and HTTP status", ["path", "status"])
+IN_FLIGHT = _metrics.gauge("irida_requests_in_flight", "Requests being processed", ["path"])
+GATE_REJECTIONS = _metrics.counter("irida_quality_gate_rejections_total", "/analyze-eye rejected as low quality", ["gate_stage"])
+_metrics.gauge("irida_cpu_jobs_in_flight", "Jobs running or waiting in the CPU pool", fn=lambda: _cpu_inflight)
+_metrics.gauge("irida_report_queue_depth", "Report jobs waiting for a worker",
+               fn=lambda: _report_queue.qsize() if _report_queue is not None else 0)
+METRICS_PATHS = ("/analyze", "/analyze-eye", "/explain", "/health", "/metrics", "/cache-stats")
+
 # --- /explain stub (schema: explain.v1) ---
 import hashlib
 import json
@@ -54,35 +73,36 @@ def _explain_stable_hash(obj) -> str:
     h = hashlib.sha256(s.encode("utf-8")).hexdigest()
     return h[:16]
 
+_EXPLAIN_RU = {
+    "summary_title": "Резюме",
+    "summary_body": "Это объяснение сформировано в режиме заглушки (stub) и предназначено для интеграции UI. Медицинской интерпретацией не является.",
+    "findings_title": "Наблюдения по качеству снимка",
+    "rec_title": "Рекомендации по пересъёмке",
+    "disc_title": "Дисклеймер",
+    "disc_body": "Результаты предназначены для информационных целей и не являются медицинским диагнозом. При любых сомнениях обратитесь к врачу.",
+    "ok": "Снимок выглядит пригодным для анализа.",
+    "bad": "Качество снимка недостаточно стабильное; возможны артефакты.",
+    "rec1": "Стабилизируйте руку и телефон, используйте опору.",
+    "rec2": "Добейтесь зелёного статуса готовности и удерживайте его 1–2 секунды.",
+    "rec3": "Избегайте бликов: слегка измените угол и расстояние.",
+}
+_EXPLAIN_EN = {
+    "summary_title": "Summary",
+    "summary_body": "This explanation is generated by a stub endpoint for UI integration. It is not a medical interpretation.",
+    "findings_title": "Image quality notes",
+    "rec_title": "Retake recommendations",
+    "disc_title": "Disclaimer",
+    "disc_body": "Results are for informational purposes and are not a medical diagnosis. Consult a qualified clinician for medical advice.",
+    "ok": "The image looks acceptable for analysis.",
+    "bad": "The image quality is not stable enough; artifacts are possible.",
+    "rec1": "Stabilize your hand and phone; use support if possible.",
+    "rec2": "Reach the green ready state and hold it for 1–2 seconds.",
+    "rec3": "Avoid glare: slightly change angle and distance.",
+}
+
 def _explain_pick(locale: str, key: str) -> str:
-    ru = {
-        "summary_title": "Резюме",
-        "summary_body": "Это объяснение сформировано в режиме заглушки (stub) и предназначено для интеграции UI. Медицинской интерпретацией не является.",
-        "findings_title": "Наблюдения по качеству снимка",
-        "rec_title": "Рекомендации по пересъёмке",
-        "disc_title": "Дисклеймер",
-        "disc_body": "Результаты предназначены для информационных целей и не являются медицинским диагнозом. При любых сомнениях обратитесь к врачу.",
-        "ok": "Снимок выглядит пригодным для анализа.",
-        "bad": "Качество снимка недостаточно стабильное; возможны артефакты.",
-        "rec1": "Стабилизируйте руку и телефон, используйте опору.",
-        "rec2": "Добейтесь зелёного статуса готовности и удерживайте его 1–2 секунды.",
-        "rec3": "Избегайте бликов: слегка измените угол и расстояние.",
-    }
-    en = {
-        "summary_title": "Summary",
-        "summary_body": "This explanation is generated by a stub endpoint for UI integration. It is not a medical interpretation.",
-        "findings_title": "Image quality notes",
-        "rec_title": "Retake recommendations",
-        "disc_title": "Disclaimer",
-        "disc_body": "Results are for informational purposes and are not a medical diagnosis. Consult a qualified clinician for medical advice.",
-        "ok": "The image looks acceptable for analysis.",
-        "bad": "The image quality is not stable enough; artifacts are possible.",
-        "rec1": "Stabilize your hand and phone; use support if possible.",
-        "rec2": "Reach the green ready state and hold it for 1–2 seconds.",
-        "rec3": "Avoid glare: slightly change angle and distance.",
-    }
-    d = ru if locale.startswith("ru") else en
-    return d.get(key, en.get(key, key))
+    d = _EXPLAIN_RU if locale.startswith("ru") else _EXPLAIN_EN
+    return d.get(key, _EXPLAIN_EN.get(key, key))
 
 def _explain_extract_quality(analysis: dict) -> dict:
     q = {}
@@ -109,24 +129,18 @@ class ExplainRequest(BaseModel):
     client: dict = Field(default_factory=dict)
     request_id: str | None = Field(default=None)
 
-@app.post("/explain")
-def explain(req: ExplainRequest):
-    def _norm_locale(v: object) -> str:
-        t = (str(v).strip() if v is not None else "")
-        if not t:
-            return "en"
-        t = t.replace("_", "-").lower()
-        if t.startswith("ru"):
-            return "ru"
-        if t.startswith("en"):
-            return "en"
-        return t.split("-", 1)[0] or "en"
-
-    locale = _norm_locale(getattr(req, "locale", None))
-    analysis = getattr(req, "analysis", {}) or {}
-    request_id = getattr(req, "request_id", None)
-
-    explanation_id = _explain_stable_hash({"locale": locale, "analysis": analysis})
+def _explain_norm_locale(v: object) -> str:
+    t = (str(v).strip() if v is not None else "")
+    if not t:
+        return "en"
+    t = t.replace("_", "-").lower()
+    if t.startswith("ru"):
+        return "ru"
+    if t.startswith("en"):
+        return "en"
+    return t.split("-", 1)[0] or "en"
+
+def _explain_render(locale: str, analysis: dict, explanation_id: str) -> Dict[str, Any]:
     q = _explain_extract_quality(analysis)
 
     quality_ok = True
@@ -216,82 +230,131 @@ def explain(req: ExplainRequest):
         "debug": {
             "stub": True,
             "quality_extracted": q,
-            "request_id": request_id,
         },
     }
+# Результат /explain детерминирован по explanation_id (локаль + analysis): отрисованный ответ
+# держим в LRU, экран результата опрашивает эндпоинт повторно — с If-None-Match получает 304.
+import threading
+from collections import OrderedDict
+from fastapi import Header
+
+EXPLAIN_CACHE_MAX = 512
+_explain_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_explain_lock = threading.Lock()
+
+def _explain_etag(explanation_id: str) -> str:
+    # слабый: generated_at и debug.request_id в теле могут отличаться
+    return f'W/"explain.v1-{explanation_id}"'
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for t in if_none_match.split(","):
+        t = t.strip()
+        if t == "*" or (t[2:] if t.startswith("W/") else t) == opaque:
+            return True
+    return False
+
+@app.post("/explain")
+def explain(req: ExplainRequest, if_none_match: str | None = Header(default=None)):
+    locale = _explain_norm_locale(getattr(req, "locale", None))
+    analysis = getattr(req, "analysis", {}) or {}
+    request_id = getattr(req, "request_id", None)
+
+    explanation_id = _explain_stable_hash({"locale": locale, "analysis": analysis})
+    etag = _explain_etag(explanation_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    with _explain_lock:
+        cached = _explain_cache.get(explanation_id)
+        if cached is not None:
+            _explain_cache.move_to_end(explanation_id)
+    if cached is None:
+        cached = _explain_render(locale, analysis, explanation_id)
+        with _explain_lock:
+            _explain_cache[explanation_id] = cached
+            while len(_explain_cache) > EXPLAIN_CACHE_MAX:
+                _explain_cache.popitem(last=False)
+
+    body = dict(cached)
+    body["debug"] = {**cached["debug"], "request_id": request_id}
+    return JSONResponse(body, headers=headers)
 # --- end /explain stub ---
 
+# --- Приём загрузок: потоковый лимит размера и проверка сигнатуры (ai/uploads.py, общий с iris_ai_server) ---
+from ai.uploads import UploadRejected, install_upload_limits, read_upload as _read_upload
+
+UPLOAD_FILES_PER_PATH = {"/analyze": 2, "/analyze-eye": 1}
+install_upload_limits(app, UPLOAD_FILES_PER_PATH)
 app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
-app.mount("/files", StaticFiles(directory=str(INBOX)), name="files")
+app.add_middleware(RequestMetricsMiddleware, requests=REQUESTS, in_flight=IN_FLIGHT,
+                   latency=REQUEST_SECONDS, paths=METRICS_PATHS)
+@app.get("/files/{exam_id}/{name}")
+async def files(exam_id: str, name: str):
+    try:
+        check_exam_id(exam_id), check_name(name)
+        path = STORAGE.local_path(exam_id, name)
+    except ValueError:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    if path is not None:
+        if not path.is_file():
+            return JSONResponse({"detail": "Not Found"}, status_code=404)
+        return FileResponse(path, media_type=media_type(name))
+    try:
+        data = await asyncio.to_thread(STORAGE.read_bytes, exam_id, name)
+    except (FileNotFoundError, KeyError):
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    return Response(data, media_type=media_type(name))
+
+@app.get("/metrics")
+async def metrics():
+    return Response(_metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
-# --- Текст (упрощённая RTL-заглушка) ---
-def _shape_rtl(text: str, locale: str) -> str:
-    lc = (locale or "en").split("-",1)[0].lower()
-    if not isinstance(text, str):
-        text = str(text)
-    if lc in ("ar","fa","ur","he"):
-        return text[::-1]
-    return text
-
-def _wrap_lines_for_pdf(text: str, max_width: float, font_name: str, font_size: int, locale: str) -> List[str]:
-    words = text.split(" ")
-    lines, line = [], ""
-    for w in words:
-        cand = (line + " " + w).strip()
-        if pdfmetrics.stringWidth(cand, "Helvetica", font_size) <= max_width:
-            line = cand
-        else:
-            if line:
-                lines.append(line)
-            line = w
-    if line:
-        lines.append(line)
-    return [_shape_rtl(l, locale) for l in lines]
-
 # --- Метрики качества и карта скорингов ---
 def _basic_quality(img: Image.Image) -> Dict[str, float]:
     g = np.asarray(img.convert("L"), dtype=np.uint8)
+    q, _ = fused_quality(g, with_map=False)
+    return q
 
-    if g.size == 0:
-        return {"brightness": 0.0, "glare": 0.0, "sharp_lapvar": 0.0}
-
-    bright = float(g.mean() / 255.0)
-    glare = float((g > 245).mean())
+# Зоны атласа [ZONE_N_ANG x ZONE_N_RAD] — как summarize_eye: кольцо между найденными зрачком и
+# радужкой (detect_circles, пирамида). Если поиск не дал правдоподобных окружностей — номинальное
+# кольцо по центру кадра, радиусы — середины диапазонов поиска detect_circles.
+ZONE_N_ANG, ZONE_N_RAD = 24, 5
+TOP_ZONES_K = 5
 
+def _eye_circles(g: np.ndarray) -> Circles:
     h, w = g.shape[:2]
-    if w >= 2:
-        gx = float(np.abs(np.diff(g.astype(np.float32), axis=1)).mean())
-    else:
-        gx = 0.0
-
-    if h >= 2:
-        gy = float(np.abs(np.diff(g.astype(np.float32), axis=0)).mean())
-    else:
-        gy = 0.0
-
-    sharp_lapvar = float(gx + gy)
-    if not np.isfinite(sharp_lapvar):
-        sharp_lapvar = 0.0
-
-    return {"brightness": bright, "glare": glare, "sharp_lapvar": sharp_lapvar}
-
-def _score_map_and_features(img: Image.Image) -> Dict[str, Any]:
-    arr = np.asarray(img.convert("L"), dtype=np.float32)
-    gx = np.zeros_like(arr, dtype=np.float32)
-    gy = np.zeros_like(arr, dtype=np.float32)
-    gx[:, 1:] = np.abs(np.diff(arr, axis=1))
-    gy[1:, :] = np.abs(np.diff(arr, axis=0))
-    g = gx + gy
-    mn, mx = float(g.min()), float(g.max())
-    if mx > mn:
-        g = (g - mn) / (mx - mn)
-    else:
-        g = np.zeros_like(g, dtype=np.float32)
-    return {"quality": _basic_quality(img), "features": [], "score_array": g}
+    try:
+        circ = detect_circles(g, pyramid=True)
+        (cx, cy), rp, ri = circ.center, circ.r_pupil, circ.r_iris
+        if 0 < rp < ri and 0 <= cx < w and 0 <= cy < h:
+            return circ
+    except cv2.error:
+        pass
+    return Circles(center=(w // 2, h // 2), r_pupil=int(0.12*min(h, w)), r_iris=int(0.37*min(h, w)))
+
+def _zone_scores(g: np.ndarray, grad: np.ndarray) -> np.ndarray:
+    # средний нормированный градиент по зонам кольца радужки -> [n_ang, n_rad]
+    strip = unwrap_iris(grad, _eye_circles(g))
+    return zone_stats(strip, ZONE_N_ANG, ZONE_N_RAD)["mean"].reshape(ZONE_N_ANG, ZONE_N_RAD)
+
+def _score_map_and_features(img: Image.Image, timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    # один перевод в L и один проход ядра: метрики качества и нормированная карта градиента;
+    # поиск окружностей и развёртка по зонам — отдельная стадия geometry
+    timings = {} if timings is None else timings
+    with timed(timings, "quality"):
+        g = np.asarray(img.convert("L"), dtype=np.uint8)
+        q, grad = fused_quality(g, with_map=True)
+    with timed(timings, "geometry"):
+        zones = _zone_scores(g, grad)
+    return {"quality": q, "zone_scores": zones, "score_array": grad}
 
 def _flags_quality(q: Dict[str, float]) -> Dict[str, Any]:
     flags, ok = [], True
@@ -303,25 +366,69 @@ def _flags_quality(q: Dict[str, float]) -> Dict[str, Any]:
         ok = False; flags.append({"code":"blurry","msg":"Низкая резкость"})
     return {"ok": ok, "flags": flags}
 
-def _top_flags(feats: List[Any], k: int):
-    return []
+def _top_flags(score_maps: Any, k: int) -> List[Any]:
+    # карта зон [n_ang, n_rad] -> k лучших зон; пачка [B, n_ang, n_rad] -> список из B таких списков.
+    # Отбор — argpartition по всей пачке разом; равные оценки — по возрастанию индекса зоны,
+    # поэтому результат не зависит от порядка, в котором partition расставил равные значения.
+    # Нечисловые оценки (NaN/inf) в выдачу не попадают: строка может вернуть меньше k зон.
+    m = np.asarray(score_maps, dtype=np.float64)
+    single = m.ndim == 2
+    if single:
+        m = m[None]
+    if m.size == 0:
+        # пустая пачка [0, n_ang, n_rad] или карта без зон
+        return [] if single or m.ndim != 3 else [[] for _ in range(m.shape[0])]
+    b, n_ang, n_rad = m.shape
+    flat = m.reshape(b, n_ang * n_rad)
+    flat = np.where(np.isfinite(flat), flat, -np.inf)
+    n = flat.shape[1]
+    k = min(max(int(k), 0), n)
+    if k == 0:
+        return [] if single else [[] for _ in range(b)]
+    # порог — k-я по величине оценка; всё выше порога берём, из равных порогу — младшие индексы
+    kth = np.take_along_axis(flat, np.argpartition(flat, n - k, axis=1)[:, n - k:n - k + 1], axis=1)
+    above = flat > kth
+    ties = flat == kth
+    need = k - above.sum(axis=1, keepdims=True)
+    chosen = above | (ties & (np.cumsum(ties, axis=1) <= need))
+    idx = np.nonzero(chosen)[1].reshape(b, k)  # ровно k на строку, индексы по возрастанию
+    vals = np.take_along_axis(flat, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    idx = np.take_along_axis(idx, order, axis=1)
+    vals = np.take_along_axis(vals, order, axis=1)
+    names = zone_names(n_ang, n_rad)[idx]
+    out = [[{"zone": str(names[i, j]), "angle_sector": int(idx[i, j]) // n_rad, "ring": int(idx[i, j]) % n_rad,
+             "score": round(float(vals[i, j]), 4)} for j in range(k) if vals[i, j] > -np.inf] for i in range(b)]
+    return out[0] if single else out
+
+# Теплокарта: длинная сторона (блочное усреднение, 0 — полное разрешение), формат png|webp и сжатие.
+# Карта уже нормирована в _score_map_and_features — здесь только уменьшение и кодирование.
+HEATMAP_MAX_SIDE = max_side_from_env("IRIDA_HEATMAP_MAX_SIDE", 512)
+HEATMAP_FORMAT = os.environ.get("IRIDA_HEATMAP_FORMAT", "png").strip().lower()
+if HEATMAP_FORMAT not in HEATMAP_FORMATS:
+    HEATMAP_FORMAT = "png"
+try:
+    HEATMAP_PNG_LEVEL = min(9, max(0, int(os.environ.get("IRIDA_HEATMAP_PNG_LEVEL", "3"))))
+except Exception:
+    HEATMAP_PNG_LEVEL = 3
+try:
+    HEATMAP_WEBP_QUALITY = min(100, max(1, int(os.environ.get("IRIDA_HEATMAP_WEBP_QUALITY", "80"))))
+except Exception:
+    HEATMAP_WEBP_QUALITY = 80
+
+def _heatmap_name(side: str) -> str:
+    return f"heatmap_{side}.{HEATMAP_FORMAT}"
 
-def _save_heatmap_png(arr: np.ndarray, path: Path) -> None:
-    a = np.asarray(arr, dtype=np.float32)
-    mn, mx = float(a.min()), float(a.max())
-    if mx > mn:
-        a = (a - mn) / (mx - mn)
-    else:
-        a = np.zeros_like(a, dtype=np.float32)
-    img = Image.fromarray((a*255).clip(0,255).astype('uint8'), mode='L')
-    img.save(str(path))
+def _save_heatmap(exam_id: str, side: str, arr: np.ndarray) -> bytes:
+    data = encode_heatmap(arr, max_side=HEATMAP_MAX_SIDE, fmt=HEATMAP_FORMAT,
+                          png_level=HEATMAP_PNG_LEVEL, webp_quality=HEATMAP_WEBP_QUALITY)
+    STORAGE.write_bytes(exam_id, _heatmap_name(side), data)
+    return data
 
 # --- Отчёты ---
 def _save_report(exam_id: str, result: Dict[str, Any]) -> None:
-    out_dir = INBOX / exam_id
-    out_dir.mkdir(parents=True, exist_ok=True)
-    (out_dir / "meta.json").write_text(json.dumps({"exam_id": exam_id}, ensure_ascii=False, indent=2), encoding="utf-8")
-    (out_dir / "report.json").write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    STORAGE.write_text(exam_id, "meta.json", json.dumps({"exam_id": exam_id}, ensure_ascii=False, indent=2))
+    STORAGE.write_text(exam_id, "report.json", json.dumps(result, ensure_ascii=False, indent=2))
 
 def _synthesize_text(result: Dict[str, Any]) -> str:
     Lq = result.get("left",{}).get("quality",{})
@@ -336,8 +443,7 @@ def _synthesize_text(result: Dict[str, Any]) -> str:
     ]
     return "\n".join(lines)
 
-def _save_report_txt(exam_id: str, result: Dict[str, Any], out_dir: Path) -> None:
-    out_dir.mkdir(parents=True, exist_ok=True)
+def _save_report_txt(exam_id: str, result: Dict[str, Any]) -> None:
     txt = result.get("text_summary","")
     Lq = result.get("left",{}).get("quality",{})
     Rq = result.get("right",{}).get("quality",{})
@@ -347,40 +453,433 @@ def _save_report_txt(exam_id: str, result: Dict[str, Any], out_dir: Path) -> Non
         f"[R] brightness={float(Rq.get('brightness',0)):.4f}, glare={float(Rq.get('glare',0)):.4f}, sharp_lapvar={float(Rq.get('sharp_lapvar',0)):.4f}",
     ]
     txt = (txt or "").rstrip() + "\n" + "\n".join(extra) + "\n"
-    (out_dir / "report.txt").write_text(txt, encoding="utf-8")
+    STORAGE.write_text(exam_id, "report.txt", txt)
 
-def _save_report_pdf(exam_id: str, result: Dict[str, Any], out_dir: Path, locale: str = "en") -> None:
-    out_dir.mkdir(parents=True, exist_ok=True)
-    pdf_path = out_dir / "report.pdf"
-    c = canvas.Canvas(str(pdf_path), pagesize=A4)
+def _render_report_pdf(exam_id: str, result: Dict[str, Any], heatmaps: Dict[str, bytes], locale: str = "en") -> bytes:
+    # PDF целиком в памяти; теплокарты — уже закодированные байты (side -> bytes), без чтения с диска
+    buf = BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
     w, h = A4
     margin = 36
     y = h - margin
 
-    c.setFont("Helvetica", 16)
     title = f"Iris Report — {exam_id}"
-    c.drawString(margin, y, title); y -= 24
-
-    c.setFont("Helvetica", 10)
     summary = result.get("text_summary", "")
-    for line in _wrap_lines_for_pdf(summary, w - 2*margin, "Helvetica", 10, locale):
-        c.drawString(margin, y, line); y -= 14
+    font = text_layout.pick_font(title + summary, locale)
+    rtl = text_layout.is_rtl(locale)
+
+    def line_out(text: str, size: int) -> None:
+        # RTL — по правому полю; конец страницы — перенос на следующую
+        nonlocal y
+        if y < margin:
+            c.showPage()
+            y = h - margin
+        c.setFont(font, size)
+        if rtl:
+            c.drawRightString(w - margin, y, text)
+        else:
+            c.drawString(margin, y, text)
+
+    for line in text_layout.wrap(title, w - 2*margin, font, 16, locale):
+        line_out(line, 16); y -= 20
+    y -= 4
+    for line in text_layout.wrap(summary, w - 2*margin, font, 10, locale):
+        line_out(line, 10); y -= 14
 
     # Вставим heatmap, если есть
-    for name in ("heatmap_left.png","heatmap_right.png"):
-        p = out_dir / name
-        if p.exists():
+    for side in ("left", "right"):
+        data = heatmaps.get(side)
+        if data:
             y -= 8
-            iw, ih = Image.open(p).size
+            img = ImageReader(BytesIO(data))
+            iw, ih = img.getSize()
             scale = min((w - 2*margin)/iw, 220/ih)
             dw, dh = iw*scale, ih*scale
-            c.drawImage(str(p), margin, max(margin, y - dh), width=dw, height=dh, preserveAspectRatio=True, anchor='sw')
+            if y - dh < margin:
+                c.showPage()
+                y = h - margin
+            c.drawImage(img, margin, y - dh, width=dw, height=dh, preserveAspectRatio=True, anchor='sw')
             y -= dh + 16
 
     c.showPage()
     c.save()
+    return buf.getvalue()
+
+def _read_heatmaps(exam_id: str) -> Dict[str, bytes]:
+    out = {}
+    for side in ("left", "right"):
+        try:
+            out[side] = STORAGE.read_bytes(exam_id, _heatmap_name(side))
+        except (FileNotFoundError, KeyError):
+            pass
+    return out
+
+def _save_report_pdf(exam_id: str, result: Dict[str, Any], locale: str = "en",
+                     heatmaps: Dict[str, bytes] | None = None) -> None:
+    # heatmaps=None — взять сохранённые теплокарты (отчёт пересобирается вне запроса)
+    if heatmaps is None:
+        heatmaps = _read_heatmaps(exam_id)
+    STORAGE.write_bytes(exam_id, "report.pdf", _render_report_pdf(exam_id, result, heatmaps, locale))
+
+# --- Пул для CPU-стадий (декодирование, метрики, отчёты) ---
+# Обработчики async: тяжёлая работа уходит в пул, цикл событий остаётся свободным (/health и т.п.).
+# Очередь ограничена: при переполнении — 503 + Retry-After.
+# Процессы пула стартуют через forkserver: fork из многопоточного сервера (поток журнала аудита,
+# to_thread, захваченные блокировки хранилища и метрик) может унести в потомка чужую блокировку.
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, str(default))))
+    except Exception:
+        return default
+
+CPU_EXECUTOR = os.environ.get("IRIDA_CPU_EXECUTOR", "process").strip().lower()  # process | thread
+CPU_WORKERS = max(1, _env_int("IRIDA_CPU_WORKERS", os.cpu_count() or 1))
+CPU_QUEUE_MAX = _env_int("IRIDA_CPU_QUEUE_MAX", 4 * CPU_WORKERS)
+CPU_RETRY_AFTER_S = max(1, _env_int("IRIDA_CPU_RETRY_AFTER_S", 2))
+
+_cpu_pool: Executor | None = None
+_cpu_inflight = 0
+
+class CpuBusy(Exception):
+    pass
+
+def _get_cpu_pool() -> Executor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        if CPU_EXECUTOR == "thread":
+            _cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="irida-cpu")
+        else:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _cpu_pool
+
+async def _run_cpu(fn, *args, admit: bool = True):
+    # fn и аргументы должны сериализоваться pickle (функции уровня модуля, bytes/str/числа).
+    # admit=False — фоновые задачи (отчёты): не отклоняются, но занимают место в общем счётчике,
+    # поэтому новые запросы получают 503, пока пул загружен отчётами
+    global _cpu_inflight
+    if admit and _cpu_inflight >= CPU_WORKERS + CPU_QUEUE_MAX:
+        raise CpuBusy()
+    _cpu_inflight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_cpu_pool(), fn, *args)
+    finally:
+        _cpu_inflight -= 1
+
+@app.exception_handler(CpuBusy)
+async def _cpu_busy_handler(request, exc):
+    return JSONResponse(
+        {"status": "busy", "detail": "analysis queue is full, retry later"},
+        status_code=503,
+        headers={"Retry-After": str(CPU_RETRY_AFTER_S)},
+    )
+
+@app.on_event("shutdown")
+def _cpu_pool_shutdown():
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+
+# --- Журнал аудита ---
+# События аудита — append-only JSON lines в IRIDA_AUDIT_DIR (по умолчанию ai_audit рядом с ai_inbox;
+# ротируемые сегменты, group commit фоновым потоком, fsync каждые IRIDA_AUDIT_FSYNC_EVERY событий или
+# IRIDA_AUDIT_FSYNC_MS мс), а не отдельный файл с temp+rename на событие. Журнал содержит демографию
+# всех обследований, поэтому он вне дерева, которое раздаёт /files.
+# По обследованию: python -m ai.audit_log ai_audit <exam_id>
+from ai.audit_log import AuditLog
+
+AUDIT_DIR = Path(os.environ.get("IRIDA_AUDIT_DIR", "").strip() or BASE_DIR / "ai_audit")
+_audit_log = AuditLog(
+    AUDIT_DIR,
+    fsync_every=_env_int("IRIDA_AUDIT_FSYNC_EVERY", 64),
+    fsync_ms=_env_int("IRIDA_AUDIT_FSYNC_MS", 200),
+    segment_max_bytes=_env_int("IRIDA_AUDIT_SEGMENT_MB", 64) * 1024 * 1024,
+)
+
+_metrics.counter("irida_audit_write_errors_total", "Audit log batches lost to write/fsync errors",
+                 fn=lambda: _audit_log.stats["errors"])
+
+def _audit_save(payload: dict, kind: str) -> None:
+    t0 = time.perf_counter()
+    _audit_log.append({"ts_ms": int(time.time() * 1000), "pid": os.getpid(), "kind": kind, **payload})
+    STAGE_SECONDS.observe(time.perf_counter() - t0, stage="audit")
+
+@app.on_event("shutdown")
+def _audit_log_shutdown():
+    _audit_log.close()
+
+# --- Кэш результатов по содержимому загрузки ---
+# Повторная загрузка тех же байтов (ретраи клиента, повторная отправка обследования) не
+# декодируется и не скорится заново. Ключ — sha256(версия алгоритма + параметры + байты);
+# память — LRU по размеру JSON, диск — INBOX/_cache с теплокартой рядом, вытеснение по объёму;
+# при IRIDA_RESULT_CACHE_DISK_MB=0 теплокарта хранится в памяти вместе с записью.
+# ANALYSIS_VERSION поднимать при любом изменении метрик/скоринга — старые записи станут недостижимы.
+from ai.result_cache import ResultCache, content_key
+
+ANALYSIS_VERSION = "q3"
+RESULT_CACHE = os.environ.get("IRIDA_RESULT_CACHE", "1").strip() not in ("0", "false", "no")
+RESULT_CACHE_MEM_MB = _env_int("IRIDA_RESULT_CACHE_MEM_MB", 32)
+RESULT_CACHE_DISK_MB = _env_int("IRIDA_RESULT_CACHE_DISK_MB", 1024)
+RESULT_CACHE_DIR = INBOX / "_cache"
+
+_result_cache = ResultCache(
+    RESULT_CACHE_DIR if RESULT_CACHE_DISK_MB > 0 else None,
+    RESULT_CACHE_MEM_MB * 1024 * 1024,
+    RESULT_CACHE_DISK_MB * 1024 * 1024,
+)
+
+async def _cache_get(key: str) -> Dict[str, Any] | None:
+    if not RESULT_CACHE:
+        return None
+    # дисковый уровень — файловый ввод-вывод, не в цикле событий
+    return await asyncio.to_thread(_result_cache.get, key)
+
+async def _cache_key(data: bytes, *parts: Any) -> str:
+    return await asyncio.to_thread(content_key, data, ANALYSIS_VERSION, *parts)
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return {"enabled": RESULT_CACHE, "version": ANALYSIS_VERSION, **_result_cache.stats()}
+
+# --- Хранение и очистка INBOX ---
+# Фоновый проход раз в IRIDA_RETENTION_INTERVAL_S: каталоги обследований старше IRIDA_INBOX_TTL_DAYS
+# удаляются, при превышении IRIDA_INBOX_MAX_MB — самые старые; после IRIDA_INBOX_COMPACT_DAYS у
+# обследования остаются снимки и JSON/TXT, а теплокарты и report.pdf удаляются насовсем
+# (/files отвечает на них 404; результаты — в report.json). По умолчанию выключено всё, кроме уборки недописанных .tmp. _cache не трогается:
+# у кэша своя квота; журнал аудита лежит вне INBOX и не удаляется. Для object-хранилища — правила жизненного цикла бакета.
+from ai.retention import ExamDirsTarget, Policy, RetentionService, env_bytes_mb, env_seconds, run_periodically
+
+RETENTION_INTERVAL_S = _env_int("IRIDA_RETENTION_INTERVAL_S", 600)
+_retention = RetentionService(
+    [(ExamDirsTarget("inbox", STORAGE), Policy(
+        ttl_s=env_seconds("IRIDA_INBOX_TTL_DAYS", 0, 86400),
+        max_bytes=env_bytes_mb("IRIDA_INBOX_MAX_MB", 0),
+        compact_after_s=env_seconds("IRIDA_INBOX_COMPACT_DAYS", 0, 86400),
+        compact_patterns=("heatmap_*", "report.pdf"),
+    ))],
+    batch=max(1, _env_int("IRIDA_RETENTION_BATCH", 200)),
+    pause_s=_env_int("IRIDA_RETENTION_PAUSE_MS", 50) / 1000.0,
+    # проход — не больше IRIDA_RETENTION_PASS_MAX каталогов, следующий продолжает с курсора
+    max_per_pass=max(0, _env_int("IRIDA_RETENTION_PASS_MAX", 5000)),
+    state_path=INBOX / "_retention.json",
+)
+_retention_task: asyncio.Task | None = None
+
+@app.on_event("startup")
+async def _retention_start():
+    global _retention_task
+    if RETENTION_INTERVAL_S > 0 and _retention_task is None:
+        _retention_task = asyncio.create_task(
+            run_periodically(_retention, RETENTION_INTERVAL_S))
+
+@app.on_event("shutdown")
+async def _retention_stop():
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
+
+@app.get("/retention")
+async def retention_status():
+    return {"interval_s": RETENTION_INTERVAL_S, **_retention.status()}
 
 # --- Основной эндпоинт ---
+def _score_eye_job(exam_id: str, side: str, data: bytes) -> Dict[str, Any]:
+    # Выполняется в пуле: декодирование, скоринг и теплокарта одного глаза
+    # (карта градиента живёт только здесь, наружу — метрики, оценки зон и время стадий)
+    timings: Dict[str, float] = {}
+    with timed(timings, "decode"):
+        img = decode_image(data, ANALYZE_MAX_SIDE)
+    s = _score_map_and_features(img, timings)
+    with timed(timings, "heatmap"):
+        heatmap = _save_heatmap(exam_id, side, s["score_array"])
+    return {"quality": s["quality"], "zone_scores": s["zone_scores"].tolist(),
+            "heatmap": heatmap, "timings": timings}
+
+async def _score_eye(exam_id: str, side: str, data: bytes) -> Tuple[Dict[str, Any], bytes]:
+    # -> (quality/zone_scores, закодированная теплокарта для отчёта)
+    cached_name = f"heatmap.{HEATMAP_FORMAT}"
+    key = await _cache_key(data, "score", ANALYZE_MAX_SIDE,
+                           HEATMAP_MAX_SIDE, HEATMAP_FORMAT, HEATMAP_PNG_LEVEL, HEATMAP_WEBP_QUALITY)
+    hit = await _cache_get(key)
+    src = _result_cache.file_path(key, cached_name) if hit is not None else None
+    if src is not None:
+        def restore() -> bytes:
+            STORAGE.link_file(exam_id, _heatmap_name(side), src)
+            return src.read_bytes()
+        try:
+            return hit, await asyncio.to_thread(restore)
+        except OSError:
+            pass  # запись кэша вытеснили между проверкой и чтением — считаем заново
+    elif hit is not None:
+        # без дискового уровня (IRIDA_RESULT_CACHE_DISK_MB=0) теплокарта хранится в памяти байтами
+        heatmap_bytes = _result_cache.file_bytes(key, cached_name)
+        if heatmap_bytes is not None:
+            await asyncio.to_thread(STORAGE.write_bytes, exam_id, _heatmap_name(side), heatmap_bytes)
+            return hit, heatmap_bytes
+    scored = await _run_cpu(_score_eye_job, exam_id, side, data)
+    observe_stages(STAGE_SECONDS, scored.pop("timings", None))
+    heatmap_bytes = scored.pop("heatmap")
+    if RESULT_CACHE:
+        await asyncio.to_thread(_result_cache.put, key, scored, {cached_name: heatmap_bytes})
+    return scored, heatmap_bytes
+
+def _eye_result(s: Dict[str, Any], top_zones: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "quality": s["quality"],
+        "quality_flags": _flags_quality(s["quality"]),
+        "top_zones": top_zones,
+        "score_map": "saved",
+    }
+
+def _build_result(exam_id: str, age: int, gender: str, task: str,
+                  L: Dict[str, Any], R: Dict[str, Any]) -> Dict[str, Any]:
+    # оба глаза ранжируются одним вызовом по пачке [2, n_ang, n_rad]
+    top_left, top_right = _top_flags([L["zone_scores"], R["zone_scores"]], TOP_ZONES_K)
+    result = {
+        "exam_id": exam_id,
+        "age": age,
+        "gender": gender,
+        "task_received": task,
+        "left": _eye_result(L, top_left),
+        "right": _eye_result(R, top_right),
+    }
+    result["text_summary"] = _synthesize_text(result)
+    return result
+
+def _report_job(exam_id: str, result: Dict[str, Any], locale: str,
+                heatmaps: Dict[str, bytes] | None = None) -> Dict[str, float]:
+    # report.json / report.txt / report.pdf (теплокарты — байтами из скоринга). -> время стадий
+    timings: Dict[str, float] = {}
+    with timed(timings, "report_json"):
+        _save_report(exam_id, result)
+    with timed(timings, "report_txt"):
+        _save_report_txt(exam_id, result)
+    with timed(timings, "report_pdf"):
+        _save_report_pdf(exam_id, result, locale=locale, heatmaps=heatmaps)
+    return timings
+
+def _report_pdf_job(exam_id: str, result: Dict[str, Any], locale: str,
+                    heatmaps: Dict[str, bytes]) -> Tuple[bytes, Dict[str, float]]:
+    # для выдачи PDF прямо в ответе: только рендер в память, архив пишет _archive_report после ответа
+    timings: Dict[str, float] = {}
+    with timed(timings, "report_pdf"):
+        pdf = _render_report_pdf(exam_id, result, heatmaps, locale)
+    return pdf, timings
+
+def _archive_report(exam_id: str, result: Dict[str, Any], pdf: bytes) -> None:
+    timings: Dict[str, float] = {}
+    with timed(timings, "report_json"):
+        _save_report(exam_id, result)
+    with timed(timings, "report_txt"):
+        _save_report_txt(exam_id, result)
+    with timed(timings, "report_archive"):
+        STORAGE.write_bytes(exam_id, "report.pdf", pdf)
+    observe_stages(STAGE_SECONDS, timings)
+
+# --- Фоновая очередь отчётов ---
+# /analyze отвечает сразу после скоринга; отчёты строят REPORT_CONCURRENCY asyncio-воркеров
+# через тот же пул CPU, с повторами при ошибке. Статус — GET /report-status/{job_id}.
+# Очередь ограничена IRIDA_REPORT_QUEUE_MAX (задача держит результат и теплокарты): при переполнении —
+# 503 + Retry-After, как у пула CPU. Из журнала задач вытесняются только завершённые.
+import uuid
+from collections import OrderedDict
+
+REPORT_ASYNC = os.environ.get("IRIDA_REPORT_ASYNC", "1").strip() not in ("0", "false", "no")
+REPORT_CONCURRENCY = max(1, _env_int("IRIDA_REPORT_CONCURRENCY", 2))
+REPORT_RETRIES = _env_int("IRIDA_REPORT_RETRIES", 2)
+try:
+    REPORT_RETRY_DELAY_S = max(0.0, float(os.environ.get("IRIDA_REPORT_RETRY_DELAY_S", "1.0")))
+except Exception:
+    REPORT_RETRY_DELAY_S = 1.0
+REPORT_QUEUE_MAX = max(1, _env_int("IRIDA_REPORT_QUEUE_MAX", 64))
+REPORT_JOBS_KEEP = 1000  # сколько завершённых задач помнить (старые вытесняются)
+
+_report_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_report_queue: asyncio.Queue | None = None
+_report_workers: List[asyncio.Task] = []
+
+def _report_job_view(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    exam_id = job["exam_id"]
+    return {
+        "job_id": job_id,
+        "exam_id": exam_id,
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "error": job.get("error"),
+        "report_pdf": f"/files/{exam_id}/report.pdf" if job["status"] == "done" else None,
+        "report_txt": f"/files/{exam_id}/report.txt" if job["status"] == "done" else None,
+        "status_url": f"/report-status/{job_id}",
+    }
+
+def _report_queue_full() -> bool:
+    return _report_queue is not None and _report_queue.full()
+
+def _trim_report_jobs() -> None:
+    # queued/running не вытесняются: воркер должен найти свою задачу, клиент — её статус
+    excess = len(_report_jobs) - REPORT_JOBS_KEEP
+    if excess <= 0:
+        return
+    for job_id in [j for j, job in _report_jobs.items() if job["status"] in ("done", "failed")][:excess]:
+        del _report_jobs[job_id]
+
+async def _report_worker() -> None:
+    while True:
+        job_id, args = await _report_queue.get()
+        job = _report_jobs.get(job_id)
+        try:
+            if job is None:
+                continue
+            for attempt in range(1, REPORT_RETRIES + 2):
+                job["status"], job["attempts"] = "running", attempt
+                try:
+                    observe_stages(STAGE_SECONDS, await _run_cpu(_report_job, *args, admit=False))
+                    job["status"], job["error"] = "done", None
+                    break
+                except Exception as e:
+                    job["error"] = f"{type(e).__name__}: {e}"
+                    if attempt > REPORT_RETRIES:
+                        job["status"] = "failed"
+                    else:
+                        await asyncio.sleep(REPORT_RETRY_DELAY_S * attempt)
+        finally:
+            _report_queue.task_done()
+
+def _enqueue_report(exam_id: str, result: Dict[str, Any], locale: str,
+                    heatmaps: Dict[str, bytes] | None = None) -> Dict[str, Any]:
+    global _report_queue
+    if _report_queue is None:
+        _report_queue = asyncio.Queue(maxsize=REPORT_QUEUE_MAX)
+    if _report_queue.full():
+        raise CpuBusy()
+    _report_workers[:] = [t for t in _report_workers if not t.done()]
+    while len(_report_workers) < REPORT_CONCURRENCY:
+        _report_workers.append(asyncio.get_running_loop().create_task(_report_worker()))
+
+    job_id = uuid.uuid4().hex
+    _report_queue.put_nowait((job_id, (exam_id, result, locale, heatmaps)))
+    _report_jobs[job_id] = {"exam_id": exam_id, "status": "queued", "attempts": 0}
+    _trim_report_jobs()
+    return _report_job_view(job_id, _report_jobs[job_id])
+
+@app.on_event("shutdown")
+async def _report_workers_shutdown():
+    for t in _report_workers:
+        t.cancel()
+    _report_workers.clear()
+
+@app.get("/report-status/{job_id}")
+async def report_status(job_id: str):
+    job = _report_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"job_id": job_id, "status": "unknown"}, status_code=404)
+    return _report_job_view(job_id, job)
+
 @app.post("/analyze")
 async def analyze(
     exam_id: str = Form(...),
@@ -388,47 +887,73 @@ async def analyze(
     gender: str = Form(...),
     locale: str = Form(default="en"),
     task: str = Form(default=""),
+    response_format: str = Form(default="json"),
     left: UploadFile = File(...),
     right: UploadFile = File(...),
 ):
-    out_dir = INBOX / exam_id
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    Limg = Image.open(left.file).convert("RGB")
-    Rimg = Image.open(right.file).convert("RGB")
-
-    L = _score_map_and_features(Limg)
-    R = _score_map_and_features(Rimg)
-
-    _save_heatmap_png(L["score_array"], out_dir / "heatmap_left.png")
-    _save_heatmap_png(R["score_array"], out_dir / "heatmap_right.png")
-
-    result = {
-        "exam_id": exam_id,
-        "age": age,
-        "gender": gender,
-        "task_received": task,
-        "left": {
-            "quality": L["quality"],
-            "quality_flags": _flags_quality(L["quality"]),
-            "top_zones": _top_flags(L["features"], 5),
-            "score_map": "saved",
-        },
-        "right": {
-            "quality": R["quality"],
-            "quality_flags": _flags_quality(R["quality"]),
-            "top_zones": _top_flags(R["features"], 5),
-            "score_map": "saved",
-        },
-    }
+    timings: Dict[str, float] = {}
+    with timed(timings, "upload_read"):
+        left_bytes = await _read_upload(left, field="left")
+        right_bytes = await _read_upload(right, field="right")
+    observe_stages(STAGE_SECONDS, timings)
+    if REPORT_ASYNC and response_format.strip().lower() != "pdf" and _report_queue_full():
+        raise CpuBusy()  # отказ до скоринга; повтор после 503 всё равно возьмёт оценки из кэша
+    # глаза независимы: обе задачи в пуле CPU одновременно, отчёт — после обеих
+    (L, L_heatmap), (R, R_heatmap) = await asyncio.gather(
+        _score_eye(exam_id, "left", left_bytes),
+        _score_eye(exam_id, "right", right_bytes),
+    )
+    heatmaps = {"left": L_heatmap, "right": R_heatmap}
+    result = _build_result(exam_id, age, gender, task, L, R)
+
+    if response_format.strip().lower() == "pdf":
+        # PDF сразу в ответ; report.json/txt/pdf в INBOX — фоновой задачей после отправки
+        pdf, timings = await _run_cpu(_report_pdf_job, exam_id, result, locale, heatmaps)
+        observe_stages(STAGE_SECONDS, timings)
+        return Response(
+            pdf,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'inline; filename="report_{exam_id}.pdf"', "X-Exam-Id": exam_id},
+            background=BackgroundTask(_archive_report, exam_id, result, pdf),
+        )
 
-    result["text_summary"] = _synthesize_text(result)
-    _save_report(exam_id, result)
-    _save_report_txt(exam_id, result, out_dir)
-    _save_report_pdf(exam_id, result, out_dir, locale=locale)
+    if REPORT_ASYNC:
+        result["report_job"] = _enqueue_report(exam_id, dict(result), locale, heatmaps)
+    else:
+        observe_stages(STAGE_SECONDS, await _run_cpu(_report_job, exam_id, result, locale, heatmaps))
     result["report_pdf"] = f"/files/{exam_id}/report.pdf"
     result["report_txt"] = f"/files/{exam_id}/report.txt"
     return JSONResponse(result)
+
+# Двухступенчатый гейт качества: ступень 1 — _quality_scalar по миниатюре (JPEG draft, доли мс на
+# метрики); явный брак ниже порога с запасом IRIDA_GATE_MARGIN отсекается без полного декодирования.
+# Резкость по миниатюре обычно выше полноразмерной, поэтому ранний отказ консервативен.
+GATE_THUMB_SIDE = max_side_from_env("IRIDA_GATE_THUMB_SIDE", 320)
+try:
+    GATE_MARGIN = float(os.environ.get("IRIDA_GATE_MARGIN", "0.15"))
+except Exception:
+    GATE_MARGIN = 0.15
+
+def _eye_quality_job(data: bytes, q_threshold: float):
+    # Выполняется в пуле: -> ((quality, ступень "thumbnail" | "full") | None, время стадий);
+    # None — файл не читается как изображение
+    timings: Dict[str, float] = {}
+    try:
+        if GATE_THUMB_SIDE and max(Image.open(BytesIO(data)).size) > GATE_THUMB_SIDE:
+            with timed(timings, "decode"):
+                thumb = decode_image(data, GATE_THUMB_SIDE, mode="L")
+            with timed(timings, "quality"):
+                q = _basic_quality(thumb)
+            if _quality_scalar(q) < q_threshold - GATE_MARGIN:
+                return (q, "thumbnail"), timings
+        with timed(timings, "decode"):
+            img = decode_image(data, ANALYZE_EYE_MAX_SIDE)
+    except Exception:
+        return None, timings
+    with timed(timings, "quality"):
+        q = _basic_quality(img)
+    return (q, "full"), timings
+
 def _quality_scalar(q: Dict[str, float]) -> float:
     b = float(q.get("brightness", 0.0))
     g = float(q.get("glare", 0.0))
@@ -452,13 +977,10 @@ def _zones_from_quality(q: Dict[str, float]) -> List[Dict[str, Any]]:
         zones.append({"name": "quality_gate", "score": 0.95, "note": "Качество допустимо для анализа"})
     return zones
 
-def _save_eye_file(exam_id: str, side: str, data: bytes) -> Path:
-    out_dir = INBOX / exam_id
-    out_dir.mkdir(parents=True, exist_ok=True)
+def _save_eye_file(exam_id: str, side: str, data: bytes) -> str:
     name = "left.jpg" if side == "left" else "right.jpg"
-    fp = out_dir / name
-    fp.write_bytes(data)
-    return fp
+    STORAGE.write_bytes(exam_id, name, data)
+    return name
 
 def _load_text_file(path: Path) -> str:
     try:
@@ -494,22 +1016,17 @@ async def analyze_eye(
             status_code=400,
         )
 
-    data = await file.read()
-    size_bytes = len(data)
-
+    timings: Dict[str, float] = {}
     try:
-        img = Image.open(BytesIO(data)).convert("RGB")
-    except Exception:
-        try:
-            img = Image.open(file.file).convert("RGB")
-        except Exception as e:
-            return JSONResponse(
-                {"status": "error", "field": "file", "filename": getattr(file, "filename", None), "content_type": getattr(file, "content_type", None), "size_bytes": size_bytes, "quality": 0.0, "zones": [], "took_ms": int((time.time()-t0)*1000)},
-                status_code=400,
-            )
-
-    q = _basic_quality(img)
-    q_scalar = _quality_scalar(q)
+        with timed(timings, "upload_read"):
+            data = await _read_upload(file)
+    except UploadRejected as e:
+        return JSONResponse(
+            {"status": "error", "field": "file", "filename": getattr(file, "filename", None), "content_type": getattr(file, "content_type", None), "size_bytes": int(getattr(file, "size", 0) or 0), "quality": 0.0, "zones": [], "took_ms": int((time.time()-t0)*1000), "reason": e.reason},
+            status_code=e.status_code,
+        )
+    observe_stages(STAGE_SECONDS, timings)
+    size_bytes = len(data)
 
     # --- IRIDA quality gate: reject low-quality images early ---
     try:
@@ -517,15 +1034,31 @@ async def analyze_eye(
     except Exception:
         q_threshold = 0.60
 
+    key = await _cache_key(data, "gate", ANALYZE_EYE_MAX_SIDE, GATE_THUMB_SIDE, GATE_MARGIN, q_threshold)
+    hit = await _cache_get(key)
+    if hit is not None:
+        gate = (hit["quality"], hit["gate_stage"])
+    else:
+        gate, job_timings = await _run_cpu(_eye_quality_job, data, q_threshold)
+        observe_stages(STAGE_SECONDS, job_timings)
+        if gate is not None and RESULT_CACHE:
+            await asyncio.to_thread(_result_cache.put, key, {"quality": gate[0], "gate_stage": gate[1]})
+    if gate is None:
+        return JSONResponse(
+            {"status": "error", "field": "file", "filename": getattr(file, "filename", None), "content_type": getattr(file, "content_type", None), "size_bytes": size_bytes, "quality": 0.0, "zones": [], "took_ms": int((time.time()-t0)*1000)},
+            status_code=400,
+        )
+    q, gate_stage = gate
+
+    q_scalar = _quality_scalar(q)
+
     if float(q_scalar) < q_threshold:
+        GATE_REJECTIONS.inc(gate_stage=gate_stage)
         took_ms = int((time.time() - t0) * 1000)
         # save file anyway for audit/debug
         fp = _save_eye_file(exam_id, side, data)
-        out_dir = INBOX / exam_id
-        out_dir.mkdir(parents=True, exist_ok=True)
         try:
             _audit_save(
-                out_dir,
                 {
                     "event": "analyze_eye",
                     "status": "rejected",
@@ -536,10 +1069,11 @@ async def analyze_eye(
                     "gender": gender,
                     "locale": locale,
                     "task_received": task,
-                    "file_saved": str(fp.name),
+                    "file_saved": fp,
                     "size_bytes": size_bytes,
                     "quality_scalar": float(q_scalar),
                     "quality_threshold": float(q_threshold),
+                    "gate_stage": gate_stage,
                     "took_ms": int((time.time() - t0) * 1000),
                 },
                 "rejected",
@@ -550,7 +1084,7 @@ async def analyze_eye(
             {
                 "status": "rejected",
                 "field": "file",
-                "filename": getattr(file, "filename", fp.name),
+                "filename": getattr(file, "filename", fp),
                 "content_type": getattr(file, "content_type", "image/jpeg"),
                 "size_bytes": size_bytes,
                 "quality": float(q_scalar),
@@ -562,6 +1096,7 @@ async def analyze_eye(
                     }
                 ],
                 "took_ms": took_ms,
+                "gate_stage": gate_stage,
                 "reason": "low_quality",
                 "recommendation": "retake_photo_better_light_focus_no_glare"
             }
@@ -578,7 +1113,7 @@ async def analyze_eye(
         "locale": locale,
         "task_received": task,
         "side": side,
-        "file_saved": str(fp.name),
+        "file_saved": fp,
         "quality_raw": q,
         "quality_scalar": q_scalar,
         "zones": zones,
@@ -588,13 +1123,10 @@ async def analyze_eye(
             "contract": bool(IRIDA_CONTRACT.strip()),
         },
     }
-    out_dir = INBOX / exam_id
-    out_dir.mkdir(parents=True, exist_ok=True)
-    (out_dir / f"{side}_meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    STORAGE.write_text(exam_id, f"{side}_meta.json", json.dumps(meta, ensure_ascii=False, indent=2))
 
     try:
         _audit_save(
-            out_dir,
             {
                 "event": "analyze_eye",
                 "status": "ok",
@@ -604,11 +1136,12 @@ async def analyze_eye(
                 "gender": gender,
                 "locale": locale,
                 "task_received": task,
-                "file_saved": str(fp.name),
+                "file_saved": fp,
                 "meta_saved": f"{side}_meta.json",
                 "size_bytes": size_bytes,
                 "quality_scalar": float(q_scalar),
                 "zones_count": int(len(zones) if isinstance(zones, list) else 0),
+                "gate_stage": gate_stage,
                 "took_ms": int((time.time() - t0) * 1000),
             },
             "ok",
@@ -622,12 +1155,13 @@ async def analyze_eye(
         {
             "status": "ok",
             "field": "file",
-            "filename": getattr(file, "filename", fp.name),
+            "filename": getattr(file, "filename", fp),
             "content_type": getattr(file, "content_type", "image/jpeg"),
             "size_bytes": size_bytes,
             "quality": float(q_scalar),
             "zones": zones,
             "took_ms": took_ms,
+            "gate_stage": gate_stage,
         }
     )
 
@@ -1,16 +1,23 @@
 from iris_ai_server.models.response_models import EyeAnalysis
+from iris_ai_server.utils.image_tools import analyze_quality
+
+# sharpness в API — доля 0..1, а ядро отдаёт средний |dx|+|dy| в уровнях серого:
+# от SHARP_FULL и выше кадр считается полностью резким (резкий снимок радужки ≈ 7, размытый < 1)
+SHARP_FULL = 6.0
 
 
 def evaluate_iris(img):
     """
     Временная заглушка анализа радужки.
-    Возвращает объект EyeAnalysis строго по модели.
+    Возвращает объект EyeAnalysis строго по модели; метрики качества —
+    из общего ядра (analyze_quality), текст пока фиксированный.
     """
+    q = analyze_quality(img)
 
     return EyeAnalysis(
-        brightness=0.75,
-        glare=0.00,
-        sharpness=1.00,
+        brightness=round(q["brightness"], 3),
+        glare=round(q["glare"], 3),
+        sharpness=round(min(q["sharp_lapvar"] / SHARP_FULL, 1.0), 3),
         diagnosis=(
             "Спокойная структура радужки. "
             "Признаков выраженной патологии не выявлено."
@@ -1,20 +1,101 @@
+import asyncio
 import os
-import uuid
 from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+from ai.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ai.metrics import Registry, RequestMetricsMiddleware, observe_stages, timed
+from ai.retention import FilesTarget, Policy, RetentionService, env_bytes_mb, env_seconds, run_periodically
+from ai.uploads import install_upload_limits, read_upload
 
 from iris_ai_server.utils.logger import log
 from iris_ai_server.utils.image_tools import load_image
 from iris_ai_server.analysis.evaluator import evaluate_iris
 
 # Новый PDF-движок v2
-from iris_ai_server.pdf.engine_v2 import generate_pdf_v2
+from iris_ai_server.pdf.engine_v2 import REPORT_DIR, generate_pdf_v2
+from iris_ai_server.pdf.photos import photo_for_pdf
+from iris_ai_server.pdf.resources import resource_metrics, warm_up
 
 
 app = FastAPI(
     title="IRIDA 2025 AI Server",
     version="0.6.1"
 )
+install_upload_limits(app, {"/analyze": 2})
+
+
+# -------------------------------------------------------
+# МЕТРИКИ (Prometheus, GET /metrics)
+# -------------------------------------------------------
+_metrics = Registry()
+STAGE_SECONDS = _metrics.histogram(
+    "iris_stage_seconds",
+    "Stage latency: upload_read, decode, photo_pdf, analysis, report_pdf",
+    ["stage"],
+)
+REQUEST_SECONDS = _metrics.histogram("iris_request_seconds", "Request latency by path", ["path"])
+REQUESTS = _metrics.counter("iris_requests_total", "Requests by path and HTTP status", ["path", "status"])
+IN_FLIGHT = _metrics.gauge("iris_requests_in_flight", "Requests being processed", ["path"])
+PDF_FAILURES = _metrics.counter("iris_report_pdf_failures_total", "PDF generation errors")
+app.add_middleware(RequestMetricsMiddleware, requests=REQUESTS, in_flight=IN_FLIGHT,
+                   latency=REQUEST_SECONDS, paths=("/analyze", "/health", "/metrics"))
+
+
+# -------------------------------------------------------
+# СТАРТ: шрифты и стили PDF загружаются один раз на процесс
+# -------------------------------------------------------
+@app.on_event("startup")
+async def warm_pdf_resources():
+    m = warm_up()
+    log(f"PDF ресурсы готовы: шрифт {m['font_name']}, {m['warmup_ms']} мс")
+
+
+# -------------------------------------------------------
+# ОЧИСТКА: временные фото и старые отчёты
+# -------------------------------------------------------
+# pdf/tmp — остатки временных фото прежних версий (фото для PDF теперь готовится в памяти);
+# отчёты отдаются по /report/{filename} и живут IRIDA_REPORTS_TTL_DAYS, при превышении
+# IRIDA_REPORTS_MAX_MB удаляются самые старые.
+TEMP_DIR = "iris_ai_server/pdf/tmp"
+RETENTION_INTERVAL_S = env_seconds("IRIDA_RETENTION_INTERVAL_S", 600)
+retention = RetentionService(
+    [
+        (FilesTarget("pdf_tmp", TEMP_DIR, "*.jpg"), Policy(ttl_s=env_seconds("IRIDA_PDF_TMP_TTL_S", 3600))),
+        (FilesTarget("reports", REPORT_DIR, "*.pdf"), Policy(
+            ttl_s=env_seconds("IRIDA_REPORTS_TTL_DAYS", 30, 86400),
+            max_bytes=env_bytes_mb("IRIDA_REPORTS_MAX_MB", 2048),
+        )),
+    ],
+    pause_s=env_seconds("IRIDA_RETENTION_PAUSE_MS", 50, 0.001),
+)
+_retention_task = None
+
+
+def _retention_report(report):
+    if report.get("error"):
+        log(f"Очистка: ошибка {report['error']}")
+        return
+    for name, r in report["targets"].items():
+        if r["deleted"] or r["errors"]:
+            log(f"Очистка {name}: удалено {r['deleted']}, освобождено {r['bytes_reclaimed'] // 1024} КБ, "
+                f"осталось {r['bytes_kept'] // 1024} КБ, ошибок {r['errors']}")
+
+
+@app.on_event("startup")
+async def start_retention():
+    global _retention_task
+    if RETENTION_INTERVAL_S > 0 and _retention_task is None:
+        _retention_task = asyncio.create_task(
+            run_periodically(retention, RETENTION_INTERVAL_S, _retention_report))
+
+
+@app.on_event("shutdown")
+async def stop_retention():
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
 
 
 # -------------------------------------------------------
@@ -25,16 +106,34 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return Response(_metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/pdf/resources")
+async def pdf_resources():
+    return resource_metrics()
+
+
+@app.get("/retention")
+async def retention_status():
+    return {"interval_s": RETENTION_INTERVAL_S, **retention.status()}
+
+
 # -------------------------------------------------------
-# ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ: СОХРАНИТЬ ВРЕМЕННОЕ ФОТО
+# ОДИН ГЛАЗ: ДЕКОДИРОВАНИЕ, ФОТО ДЛЯ PDF, АНАЛИЗ
 # -------------------------------------------------------
-def save_temp(img, filename: str):
-    temp_dir = "iris_ai_server/pdf/tmp"
-    os.makedirs(temp_dir, exist_ok=True)
-
-    path = os.path.join(temp_dir, filename)
-    img.save(path, format="JPEG", optimize=True, quality=95)
-    return path
+def process_eye(data: bytes):
+    # -> (JPEG для PDF, EyeAnalysis, время стадий); фото готовится в памяти из исходных байтов
+    timings = {}
+    with timed(timings, "decode"):
+        img = load_image(data)
+    with timed(timings, "photo_pdf"):
+        photo = photo_for_pdf(data, img)
+    with timed(timings, "analysis"):
+        model = evaluate_iris(img)
+    return photo, model, timings
 
 
 # -------------------------------------------------------
@@ -46,22 +145,23 @@ async def analyze(
     file_right: UploadFile = File(...)
 ):
     log("Получены файлы радужек")
+    timings = {}
 
     # ---------- ЗАГРУЗКА БАЙТОВ ----------
-    left_bytes = await file_left.read()
-    right_bytes = await file_right.read()
-
-    # ---------- В ИЗОБРАЖЕНИЯ ----------
-    img_left = load_image(left_bytes)
-    img_right = load_image(right_bytes)
-
-    # ---------- ВРЕМЕННОЕ СОХРАНЕНИЕ ДЛЯ PDF ----------
-    left_tmp_path = save_temp(img_left, f"left_{uuid.uuid4().hex}.jpg")
-    right_tmp_path = save_temp(img_right, f"right_{uuid.uuid4().hex}.jpg")
-
-    # ---------- АНАЛИЗ ----------
-    left_model = evaluate_iris(img_left)
-    right_model = evaluate_iris(img_right)
+    with timed(timings, "upload_read"):
+        left_bytes = await read_upload(file_left, field="file_left")
+        right_bytes = await read_upload(file_right, field="file_right")
+
+    # ---------- ОБА ГЛАЗА ПАРАЛЛЕЛЬНО ----------
+    # декодирование, JPEG и NumPy отпускают GIL: два потока вместо очереди L -> R,
+    # цикл событий при этом свободен; время стадий — сумма по глазам, как раньше
+    (left_photo, left_model, left_t), (right_photo, right_model, right_t) = await asyncio.gather(
+        asyncio.to_thread(process_eye, left_bytes),
+        asyncio.to_thread(process_eye, right_bytes),
+    )
+    for eye_timings in (left_t, right_t):
+        for stage, sec in eye_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + sec
 
     left_dict = left_model.model_dump()
     right_dict = right_model.model_dump()
@@ -74,20 +174,24 @@ async def analyze(
 
     # ---------- PDF ----------
     try:
-        pdf_filename = generate_pdf_v2(
-            left_dict,
-            right_dict,
-            text_summary,
-            left_img_path=left_tmp_path,
-            right_img_path=right_tmp_path
-        )
+        with timed(timings, "report_pdf"):
+            pdf_filename = generate_pdf_v2(
+                left_dict,
+                right_dict,
+                text_summary,
+                left_photo=left_photo,
+                right_photo=right_photo
+            )
 
         pdf_url = f"/report/{pdf_filename}" if pdf_filename else None
 
     except Exception as e:
         log(f"[IRIDA] Ошибка PDF: {e}")
+        PDF_FAILURES.inc()
         pdf_url = None
 
+    observe_stages(STAGE_SECONDS, timings)
+
     # ---------- ОТВЕТ ----------
     return {
         "left": left_dict,
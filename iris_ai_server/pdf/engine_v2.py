@@ -1,49 +1,22 @@
 import os
 from datetime import datetime
+from io import BytesIO
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
 from reportlab.lib.units import mm
-from reportlab.platypus import Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Table, Paragraph
+from reportlab.lib.utils import ImageReader
 
 from iris_ai_server.utils.logger import log
+from iris_ai_server.pdf.resources import normal_style, param_table_style
+from iris_ai_server.pdf.templates import define_forms, draw_page_static, draw_title_page
 
 
-# Папка для готовых PDF
-REPORT_DIR = "iris_ai_server/storage/reports"
+# Папка для готовых PDF (IRIS_REPORT_DIR)
+REPORT_DIR = os.environ.get("IRIS_REPORT_DIR", "").strip() or "iris_ai_server/storage/reports"
 os.makedirs(REPORT_DIR, exist_ok=True)
 
-# Путь к шрифту
-FONT_PATH = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)),
-    "fonts",
-    "DejaVuSans.ttf"
-)
-
-
-# --------------------------------------------------------------
-# Титульная страница
-# --------------------------------------------------------------
-def draw_title_page(c: canvas.Canvas):
-    c.setFillColor("#0A75B8")
-    c.rect(0, 0, A4[0], A4[1], fill=True, stroke=False)
-
-    c.setFillColor(colors.white)
-    c.setFont("DejaVu", 38)
-    c.drawCentredString(A4[0] / 2, A4[1] - 180, "IRIDOLOGY")
-
-    c.setFont("DejaVu", 20)
-    c.drawCentredString(A4[0] / 2, A4[1] - 230, "Medical Diagnostic Report")
-
-    c.setFont("DejaVu", 12)
-    c.drawCentredString(A4[0] / 2, 100, datetime.now().strftime("%d.%m.%Y"))
-
-    c.showPage()
-
 
 # Безопасная строка
 def safe(v):
@@ -53,36 +26,37 @@ def safe(v):
 # --------------------------------------------------------------
 # Генератор PDF v2
 # --------------------------------------------------------------
+def draw_photo(c: canvas.Canvas, x, y, photo=None, path=None):
+    # photo — байты JPEG из photos.photo_for_pdf (встраиваются без перекодирования), path — файл
+    if photo:
+        c.drawImage(ImageReader(BytesIO(photo)), x, y, width=70 * mm, height=70 * mm)
+    elif path and os.path.exists(path):
+        c.drawImage(path, x, y, width=70 * mm, height=70 * mm)
+
+
 def generate_pdf_v2(left: dict, right: dict, summary: str,
-                    left_img_path=None, right_img_path=None) -> str:
+                    left_img_path=None, right_img_path=None,
+                    left_photo: bytes = None, right_photo: bytes = None) -> str:
     try:
         filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.pdf"
         path = os.path.join(REPORT_DIR, filename)
 
-        # Canvas
-        c = canvas.Canvas(path, pagesize=A4)
+        # Canvas; сжатие потоков страниц задаётся у самого документа, глобальный rl_config не трогается
+        c = canvas.Canvas(path, pagesize=A4, pageCompression=1)
 
-        # ---------- РЕГИСТРАЦИЯ ШРИФТА ДЛЯ КИРИЛЛИЦЫ ----------
-        if os.path.exists(FONT_PATH):
-            pdfmetrics.registerFont(TTFont("DejaVu", FONT_PATH))
-        else:
-            log("[IRIDA] WARNING: Unicode font missing — fallback to Helvetica")
+        # ---------- Статика (титул, заголовки, подвал) — формы документа ----------
+        define_forms(c)
 
-        c.setFont("DejaVu", 12)
+        # Титульная страница: форма + дата
+        draw_title_page(c, datetime.now().strftime("%d.%m.%Y"))
 
-        # Титульная страница
-        draw_title_page(c)
+        # ---------- Страница результатов: форма + переменные поля ----------
+        draw_page_static(c)
 
-        # ---------- Стили Paragraph (важно для кириллицы!) ----------
-        styles = getSampleStyleSheet()
-        normal = styles["Normal"]
-        normal.fontName = "DejaVu"
-        normal.leading = 14
+        # ---------- Стиль Paragraph (важно для кириллицы!) — из кэша ----------
+        normal = normal_style()
 
         # ---------- Краткое резюме ----------
-        c.setFont("DejaVu", 18)
-        c.drawString(20 * mm, 270 * mm, "Краткое резюме")
-
         text = Paragraph(safe(summary), normal)
         text.wrapOn(c, 170 * mm, 48 * mm)
         text.drawOn(c, 20 * mm, 230 * mm)
@@ -90,42 +64,23 @@ def generate_pdf_v2(left: dict, right: dict, summary: str,
         # ---------- Фото радужек ----------
         y_img = 160 * mm
 
-        if left_img_path and os.path.exists(left_img_path):
-            c.drawImage(left_img_path, 20 * mm, y_img, width=70 * mm, height=70 * mm)
-
-        if right_img_path and os.path.exists(right_img_path):
-            c.drawImage(right_img_path, 110 * mm, y_img, width=70 * mm, height=70 * mm)
-
-        # ---------- Таблицы параметров ----------
-        def make_table(title, data_dict, y_pos):
-            c.setFont("DejaVu", 16)
-            c.drawString(20 * mm, y_pos, title)
+        draw_photo(c, 20 * mm, y_img, left_photo, left_img_path)
+        draw_photo(c, 110 * mm, y_img, right_photo, right_img_path)
 
+        # ---------- Таблицы параметров (заголовки — в форме) ----------
+        def make_table(data_dict, y_pos):
             rows = [["Параметр", "Значение"]]
             for k, v in data_dict.items():
                 rows.append([safe(k), safe(v)])
 
             table = Table(rows, colWidths=[70 * mm, 90 * mm])
-            table.setStyle(TableStyle([
-                ("BACKGROUND", (0, 0), (-1, 0), colors.lightblue),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-                ("FONTNAME", (0, 0), (-1, -1), "DejaVu"),
-                ("FONTSIZE", (0, 0), (-1, -1), 10),
-                ("GRID", (0, 0), (-1, -1), 0.25, colors.gray),
-                ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
-            ]))
+            table.setStyle(param_table_style())
 
             table.wrapOn(c, 20 * mm, y_pos - 20 * mm)
             table.drawOn(c, 20 * mm, y_pos - 20 * mm)
 
-        make_table("Левый глаз", left, 140 * mm)
-        make_table("Правый глаз", right, 70 * mm)
-
-        # ---------- Footer ----------
-        c.setFont("DejaVu", 9)
-        c.setFillColor(colors.gray)
-        c.drawCentredString(A4[0] / 2, 10 * mm, "IRIDA Medical AI — Iris Diagnostics")
+        make_table(left, 140 * mm)
+        make_table(right, 70 * mm)
 
         c.save()
 
@@ -0,0 +1,41 @@
+from io import BytesIO
+
+from PIL import Image
+
+from ai.ingest import int_env
+
+
+# --------------------------------------------------------------
+# Фото радужки для PDF: печатается в квадрат 70×70 мм, поэтому в отчёт
+# идёт JPEG под этот размер при IRIS_PDF_PHOTO_DPI (по умолчанию 200 dpi ≈ 552 px).
+# Исходный JPEG, который уже помещается, вставляется как есть (reportlab кладёт
+# JPEG в PDF без перекодирования); иначе — одно уменьшение в памяти уже
+# декодированного кадра (reduce + LANCZOS) и одно кодирование без optimize.
+# --------------------------------------------------------------
+PHOTO_BOX_MM = 70
+PHOTO_DPI = int_env("IRIS_PDF_PHOTO_DPI", 200, 72, 600)
+PHOTO_QUALITY = int_env("IRIS_PDF_PHOTO_QUALITY", 85, 1, 95)  # выше 95 Pillow только раздувает файл
+
+
+def photo_side_px(box_mm: float = PHOTO_BOX_MM, dpi: int = PHOTO_DPI) -> int:
+    return max(1, round(box_mm / 25.4 * dpi))
+
+
+def photo_for_pdf(data: bytes, decoded: Image.Image = None, box_mm: float = PHOTO_BOX_MM,
+                  dpi: int = PHOTO_DPI, quality: int = PHOTO_QUALITY) -> bytes:
+    # decoded — уже декодированный кадр (load_image): повторно байты не декодируются
+    side = photo_side_px(box_mm, dpi)
+    src = Image.open(BytesIO(data))
+    if src.format == "JPEG" and src.mode in ("RGB", "L") and max(src.size) <= side:
+        return data
+    img = decoded if decoded is not None else src
+    w, h = img.size
+    if max(w, h) > side:
+        k = side / max(w, h)
+        # reducing_gap=1: сначала целочисленный reduce (среднее по блокам), LANCZOS — на последние <2×
+        img = img.resize((max(1, round(w * k)), max(1, round(h * k))), Image.LANCZOS, reducing_gap=1.0)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+from reportlab.lib import colors
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.platypus import TableStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from iris_ai_server.utils.logger import log
+
+
+# --------------------------------------------------------------
+# Ресурсы PDF на процесс: шрифт, стили Paragraph, TableStyle.
+# Разбор TTF и сборка стилей — один раз (warm_up при старте или лениво),
+# дальше генератор отчётов берёт готовые объекты.
+# --------------------------------------------------------------
+FONT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "fonts",
+    "DejaVuSans.ttf"
+)
+FONT_NAME = "DejaVu"
+FALLBACK_FONT = "Helvetica"
+
+_lock = threading.Lock()
+_cache = {}
+_metrics = {
+    "warm": False,
+    "font_name": None,
+    "font_load_ms": 0.0,
+    "styles_build_ms": 0.0,
+    "warmup_ms": 0.0,
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def _build():
+    t0 = time.perf_counter()
+    font = FALLBACK_FONT
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        font = FONT_NAME
+    elif os.path.exists(FONT_PATH):
+        try:
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+            font = FONT_NAME
+        except Exception as e:
+            log(f"[IRIDA] WARNING: Unicode font failed to load ({e}) — fallback to Helvetica")
+    else:
+        log("[IRIDA] WARNING: Unicode font missing — fallback to Helvetica")
+    t1 = time.perf_counter()
+
+    normal = ParagraphStyle("IridaNormal", parent=getSampleStyleSheet()["Normal"],
+                            fontName=font, leading=14)
+    table = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightblue),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("FONTNAME", (0, 0), (-1, -1), font),
+        ("FONTSIZE", (0, 0), (-1, -1), 10),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.gray),
+        ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
+    ])
+    t2 = time.perf_counter()
+
+    _cache.update(font=font, normal=normal, param_table=table)
+    _metrics.update(
+        warm=True,
+        font_name=font,
+        font_load_ms=round((t1 - t0) * 1000, 3),
+        styles_build_ms=round((t2 - t1) * 1000, 3),
+        warmup_ms=round((t2 - t0) * 1000, 3),
+    )
+
+
+def _get(key):
+    if not _cache:
+        with _lock:
+            if not _cache:
+                _metrics["misses"] += 1
+                _build()
+                return _cache[key]
+    _metrics["hits"] += 1
+    return _cache[key]
+
+
+def warm_up() -> dict:
+    _get("font")
+    return resource_metrics()
+
+
+def font_name() -> str:
+    return _get("font")
+
+
+def normal_style() -> ParagraphStyle:
+    return _get("normal")
+
+
+def param_table_style() -> TableStyle:
+    return _get("param_table")
+
+
+def resource_metrics() -> dict:
+    return dict(_metrics)
@@ -0,0 +1,77 @@
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+from iris_ai_server.pdf.resources import font_name
+
+
+# --------------------------------------------------------------
+# Статическая часть отчёта v2 — form XObject'ы: фон и заголовки титула,
+# заголовки разделов и подвал страницы результатов. Разметка (строки,
+# координаты, кегли) задана здесь один раз; в документе каждая форма
+# записывается один раз (define_forms), а на страницу ставится одной
+# командой doForm — поверх дорисовываются только переменные поля.
+# XObject'ы в reportlab принадлежат документу, поэтому формы
+# определяются в каждом отчёте заново, но без повторной разметки.
+# --------------------------------------------------------------
+TITLE_FORM = "irida_v2_title"
+PAGE_FORM = "irida_v2_page"
+
+TITLE_BG = "#0A75B8"
+TITLE_TEXT = (
+    (38, A4[1] - 180, "IRIDOLOGY"),
+    (20, A4[1] - 230, "Medical Diagnostic Report"),
+)
+TITLE_DATE = (12, 100)  # кегль и y даты — единственное переменное поле титула
+
+SUMMARY_HEADING = (18, 20 * mm, 270 * mm, "Краткое резюме")
+TABLE_HEADINGS = (
+    (16, 20 * mm, 140 * mm, "Левый глаз"),
+    (16, 20 * mm, 70 * mm, "Правый глаз"),
+)
+FOOTER = (9, 10 * mm, "IRIDA Medical AI — Iris Diagnostics")
+
+
+def _title_static(c: canvas.Canvas, font: str):
+    c.setFillColor(TITLE_BG)
+    c.rect(0, 0, A4[0], A4[1], fill=True, stroke=False)
+    c.setFillColor(colors.white)
+    for size, y, text in TITLE_TEXT:
+        c.setFont(font, size)
+        c.drawCentredString(A4[0] / 2, y, text)
+
+
+def _page_static(c: canvas.Canvas, font: str):
+    size, x, y, text = SUMMARY_HEADING
+    c.setFont(font, size)
+    c.drawString(x, y, text)
+    for size, x, y, text in TABLE_HEADINGS:
+        c.setFont(font, size)
+        c.drawString(x, y, text)
+    size, y, text = FOOTER
+    c.setFont(font, size)
+    c.setFillColor(colors.gray)
+    c.drawCentredString(A4[0] / 2, y, text)
+
+
+def define_forms(c: canvas.Canvas):
+    # один раз на документ, до первой страницы; состояние canvas после форм не меняется
+    font = font_name()
+    for name, draw in ((TITLE_FORM, _title_static), (PAGE_FORM, _page_static)):
+        c.beginForm(name)
+        draw(c, font)
+        c.endForm()
+
+
+def draw_title_page(c: canvas.Canvas, date_text: str):
+    c.doForm(TITLE_FORM)
+    size, y = TITLE_DATE
+    c.setFillColor(colors.white)
+    c.setFont(font_name(), size)
+    c.drawCentredString(A4[0] / 2, y, date_text)
+    c.showPage()
+
+
+def draw_page_static(c: canvas.Canvas):
+    c.doForm(PAGE_FORM)
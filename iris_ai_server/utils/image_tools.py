@@ -1,9 +1,14 @@
 from PIL import Image
 import numpy as np
-from io import BytesIO
 
-def load_image(data: bytes):
-    return Image.open(BytesIO(data)).convert("RGB")
+from ai.ingest import decode_image, max_side_from_env
+from ai.quality_kernel import fused_quality
+
+# Фото нужны только для оценки и печати 70×70 мм в PDF — полное разрешение сенсора не требуется
+LOAD_MAX_SIDE = max_side_from_env("IRIS_LOAD_MAX_SIDE", 2048)
+
+def load_image(data: bytes, max_side: int = LOAD_MAX_SIDE):
+    return decode_image(data, max_side)
 
 def analyze_brightness(img):
     arr = np.array(img).astype(float)
@@ -13,3 +18,8 @@ def analyze_sharpness(img):
     arr = np.array(img.convert("L"))
     gy, gx = np.gradient(arr)
     return float(np.sqrt(gx**2 + gy**2).mean())
+
+def analyze_quality(img):
+    # brightness / glare / sharp_lapvar — то же ядро, что у irida_ai_server
+    q, _ = fused_quality(np.asarray(img.convert("L"), dtype=np.uint8), with_map=False)
+    return q
@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+_data = tempfile.mkdtemp(prefix="irida-test-")
+os.environ.setdefault("IRIDA_INBOX_DIR", os.path.join(_data, "ai_inbox"))
+os.environ.setdefault("IRIDA_AUDIT_DIR", os.path.join(_data, "ai_audit"))
+
+import irida_ai_server as srv  # noqa: E402
+
+N_ANG, N_RAD = srv.ZONE_N_ANG, srv.ZONE_N_RAD
+
+
+def test_empty_batch():
+    assert srv._top_flags(np.zeros((0, N_ANG, N_RAD)), 5) == []
+
+
+def test_empty_map():
+    assert srv._top_flags([], 5) == []
+    assert srv._top_flags(np.zeros((N_ANG, 0)), 5) == []
+
+
+@pytest.mark.parametrize("bad", [np.nan, np.inf, -np.inf])
+def test_non_finite_scores_dropped(bad):
+    m = np.full((N_ANG, N_RAD), bad)
+    m[3, 1], m[7, 4] = 0.9, 0.4
+    top = srv._top_flags(m, 5)
+    assert [(z["angle_sector"], z["ring"], z["score"]) for z in top] == [(3, 1, 0.9), (7, 4, 0.4)]
+    json.dumps(top, allow_nan=False)
+
+
+def test_all_nan_batch():
+    batch = np.full((2, N_ANG, N_RAD), np.nan)
+    batch[1, 0, 0] = 0.5
+    left, right = srv._top_flags(batch, 5)
+    assert left == []
+    assert [z["score"] for z in right] == [0.5]